@@ -0,0 +1,100 @@
+# throughput and peak RSS when serving a big file: old chunked path vs sendfile vs mmap
+# run from the repo root with ``python -m bench.bigfile [size in MB] [downloads]``
+# every mode runs in its own process, so the peak RSS numbers dont leak into each other
+# NOTE: mmap shows the mapped file in its RSS, but those are shared page cache pages, not heap
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import trio
+
+import srv
+from bench.client import Conn, startServer
+
+
+def legacyServe(server: srv.Server, path, url):
+    # this is how Server.streamServe used to send files
+    s = os.path.getsize(path)
+    send = server.buildReq(200, srv.mtype(path), b'', s)
+    chunks = 4000000
+
+    async def read(send, f, s):
+        b = await f.read(s)
+        await send.send(b)
+
+    @server.handler(url)
+    async def fn(r: srv.Request):
+        si = s
+        await r.sendRaw(send)
+        async with await trio.open_file(path, 'rb') as f:
+            async with trio.open_nursery() as nurs:
+                dat = await f.read(chunks)
+                _send, recv = trio.open_memory_channel(chunks)
+                while si > 0:
+                    nurs.start_soon(read, _send, f, min(si, chunks))
+                    si -= chunks
+                    await r.sendRaw(dat)
+                    dat = await recv.receive()
+                await _send.aclose()
+
+
+async def download(conn: Conn, size):
+    await conn.stream.send_all(b'GET /big.bin HTTP/1.1\r\n\r\n')
+    head = await conn.reader.readHead(65536)
+    assert head.startswith(b'HTTP/1.1 200'), head
+    left = size
+    while left:
+        # NOTE: throw the data away right away, we only care about the server side
+        left -= len(await conn.reader.receive(min(left, 1 << 20)))
+
+
+async def child(mode, path, n):
+    server = srv.Server(host='127.0.0.1')
+    if mode == 'legacy':
+        legacyServe(server, path, '/big.bin')
+    else:
+        server.sendfile = mode == 'sendfile'
+        server.streamServe(path, '/big.bin')
+
+    size = os.path.getsize(path)
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    async with trio.open_nursery() as nurs:
+        port = await startServer(server, nurs)
+        conn = await Conn.open('127.0.0.1', port)
+        start = time.perf_counter()
+        for _ in range(n):
+            await download(conn, size)
+        took = time.perf_counter() - start
+        await conn.aclose()
+        nurs.cancel_scope.cancel()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        f'{mode:>9}: {size * n / took / 1e6:8.1f} MB/s,'
+        f' peak RSS +{(peak - base) / 1024:6.1f} MB over a {base / 1024:.1f} MB baseline'
+    )
+
+
+def main(mb, n):
+    with tempfile.NamedTemporaryFile(suffix='.bin') as f:
+        for _ in range(mb):
+            f.write(os.urandom(1 << 20))
+        f.flush()
+        for mode in ('legacy', 'mmap', 'sendfile'):
+            subprocess.run(
+                [sys.executable, '-m', 'bench.bigfile', '--child', mode, f.name, str(n)],
+                check=True,
+            )
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        trio.run(child, sys.argv[2], sys.argv[3], int(sys.argv[4]))
+    else:
+        main(
+            int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+            int(sys.argv[2]) if len(sys.argv) > 2 else 5,
+        )
@@ -0,0 +1,90 @@
+# a tiny http/1.1 client for the benchmarks - just enough to talk to srv.Server
+import trio
+
+import srv
+
+
+def request(path: str, headers: dict[str, str] = {}):
+    return (
+        f'GET {path} HTTP/1.1\r\nHost: localhost\r\n'
+        + ''.join(f'{name}: {val}\r\n' for name, val in headers.items())
+        + '\r\n'
+    ).encode()
+
+
+class Conn:
+    def __init__(self, stream: trio.SocketStream):
+        self.stream = stream
+        self.reader = srv.Reader(stream)
+
+    @classmethod
+    async def open(cls, host, port):
+        return cls(await trio.open_tcp_stream(host, port))
+
+    async def response(self):
+        head = await self.reader.readHead(65536)
+        if head is None:
+            raise ConnectionError('server closed the connection')
+        lines = head.decode().splitlines()
+        status = int(lines[0].split(' ')[1])
+        headers = {}
+        for l in lines[1:]:
+            name, _, val = l.partition(':')
+            headers[name.strip().lower()] = val.strip()
+
+        left = int(headers.get('content-length', '0'))
+        body = bytearray()
+        while left > 0:
+            if not (data := await self.reader.receive(left)):
+                raise ConnectionError('server closed the connection mid-body')
+            body += data
+            left -= len(data)
+        return status, headers, bytes(body)
+
+    async def get(self, path: str, headers: dict[str, str] = {}):
+        await self.stream.send_all(request(path, headers))
+        return await self.response()
+
+    async def pipeline(self, paths: list[str], headers: dict[str, str] = {}):
+        # send everything at once, then read the responses back in order
+        await self.stream.send_all(b''.join(request(p, headers) for p in paths))
+        return [await self.response() for _ in paths]
+
+    async def aclose(self):
+        await self.stream.aclose()
+
+
+async def get(host, port, path: str, headers: dict[str, str] = {}):
+    # one request on a fresh connection
+    conn = await Conn.open(host, port)
+    try:
+        return await conn.get(path, {**headers, 'Connection': 'close'})
+    finally:
+        await conn.aclose()
+
+
+async def startServer(server: srv.Server, nurs: trio.Nursery):
+    # start ``server`` on a random loopback port and return that port
+    listeners = await nurs.start(
+        lambda task_status: trio.serve_tcp(
+            server.handle, 0, host='127.0.0.1', task_status=task_status
+        )
+    )
+    return listeners[0].socket.getsockname()[1]
+
+
+async def serveDir(server: srv.Server, origin: str, prefix=''):
+    # like paths/static.py, but without the inotify watcher
+    import os
+
+    for file in sorted(os.listdir(origin)):
+        fpath = os.path.join(origin, file)
+        if os.path.isdir(fpath):
+            await serveDir(server, fpath, prefix + '/' + file)
+        else:
+            await server.serve(fpath, prefix + '/' + file)
+
+
+def percentile(samples: list[float], p: float):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
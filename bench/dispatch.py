@@ -0,0 +1,46 @@
+# how many rules buildTree tries with and without the first-token index, over content/ and a bigger
+# synthetic document
+# run from the repo root with ``python -m bench.dispatch``
+import collections
+import time
+
+import md2html
+from bench.packrat import doc
+from bench.tokenizer import docs, quiet
+
+
+def run(docs: dict[str, str], dispatch: bool):
+    md2html.dispatch = dispatch
+    md2html.attempts = collections.Counter()
+    out = {}
+    start = time.perf_counter()
+    with quiet():
+        for name, cont in docs.items():
+            out[name] = md2html.md2html(cont).generate()
+    took = time.perf_counter() - start
+    counts, md2html.attempts, md2html.dispatch = md2html.attempts, None, True
+    return out, counts, took
+
+
+def main():
+    content = {**docs(), 'synthetic 256kb': doc(256 * 1024)}
+
+    for name, cont in content.items():
+        old, before, oldTook = run({name: cont}, False)
+        new, after, newTook = run({name: cont}, True)
+        assert old == new, f'{name}: dispatching changed the output'
+        print(
+            f'{name:>26} {sum(before.values()):>9} -> {sum(after.values()):>7} attempts'
+            f' {oldTook:>7.3f}s -> {newTook:.3f}s'
+        )
+
+    # where the attempts went, for everything together
+    _, before, _ = run(content, False)
+    _, after, _ = run(content, True)
+    print(f'\n{"before":>9} {"after":>9}  rule')
+    for rule, n in before.most_common():
+        print(f'{n:>9} {after[rule]:>9}  {repr(rule)[:80]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# genweb serialization of deeply nested trees: the old recursive generate vs the streaming one,
+# time and peak memory (with tracemalloc) for each
+# run from the repo root with ``python -m bench.generate``
+import os
+import time
+import tracemalloc
+
+import genweb as w
+
+
+def recursive(node: w.Generatable):
+    # this is how Tag.generate and Joined.generate used to work
+    if isinstance(node, w.Tag):
+        attrs = (
+            ' ' + ' '.join([f'{a}={b}' for a, b in node.attrs.items()]) if node.attrs else ''
+        )
+        children = ''.join([recursive(c) for c in node.children])
+        if children:
+            return f'<{node.name}{attrs}>{children}</{node.name}>'
+        return f'<{node.name}{attrs}/>'
+    if isinstance(node, w.Joined):
+        return ''.join([recursive(g) for g in node.children])
+    return node.generate()
+
+
+def nested(depth: int, width=20):
+    # a list nested ``depth`` levels deep (like md2html makes for - -- --- ...), with ``width``
+    # items of text on every level
+    root = cur = w.ul()
+    for d in range(depth):
+        for n in range(width):
+            text = [w.Content(f'item {n} on level {d} '), w.i({}, [w.Content('x')])]
+            cur.children.append(w.li({}, text))
+        cur.children.append(cur := w.ul({'class': f'"l{d}"'}))
+    return w.Joined([w.head({}, [w.title({}, [w.Content('nested')])]), w.body({}, [root])])
+
+
+def measure(fn):
+    # timed on its own, tracemalloc slows the allocations down a lot
+    start = time.perf_counter()
+    try:
+        fn()
+    except RecursionError:
+        return f'{"too deep":>17}'
+    took = time.perf_counter() - start
+
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return f'{took:7.3f}s {peak / 2**20:7.1f}MB'
+
+
+def main():
+    print(f'{"depth":>6} {"recursive":>17} {"generate":>17} {"write":>17}')
+    with open(os.devnull, 'w') as devnull:
+        for depth in (100, 500, 900, 2000, 10000):
+            tree = nested(depth)
+            old = measure(lambda: recursive(tree))
+            new = measure(lambda: ''.join(w.chunks(tree)))
+            streamed = measure(lambda: w.write(tree, devnull))
+            if 'too deep' not in old:
+                assert recursive(tree) == tree.generate(), 'the output changed'
+            print(f'{depth:>6} {old:>17} {new:>17} {streamed:>17}')
+
+
+if __name__ == '__main__':
+    main()
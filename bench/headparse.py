@@ -0,0 +1,83 @@
+# microbenchmark: buffered head parser vs the old byte-at-a-time loop
+# run from the repo root with ``python -m bench.headparse``
+import sys
+import time
+
+import trio
+
+import srv
+
+REQ = (
+    b'GET /fritior-nansen.html?a=1 HTTP/1.1\r\n'
+    b'Host: localhost:8080\r\n'
+    b'User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0\r\n'
+    b'Accept: text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8\r\n'
+    b'Accept-Language: bg,en-US;q=0.7,en;q=0.3\r\n'
+    b'Accept-Encoding: gzip, deflate, br, zstd\r\n'
+    b'Connection: keep-alive\r\n'
+    b'Upgrade-Insecure-Requests: 1\r\n'
+    b'\r\n'
+)
+
+
+class FakeStream:
+    # behaves like a socket with the whole request already in the kernel buffer
+    def __init__(self, data: bytes):
+        self.data = data
+        self.c = 0
+        self.calls = 0
+
+    async def receive_some(self, n):
+        self.calls += 1
+        self.c += n
+        return self.data[self.c - n : self.c]
+
+
+async def legacy(stream):
+    # this is the loop Server.handle used before the buffered reader
+    buf = b''
+    lines = []
+    headers = {}
+    while c := await stream.receive_some(1):
+        if c == b'\n':
+            if buf[-1] == ord('\r'):
+                buf = buf[:-1]
+            if not buf:
+                break
+            lines.append(buf)
+            buf = b''
+            continue
+        buf += c
+
+    for l in lines[1:]:
+        parts = l.decode().split(':')
+        headers[parts[0].strip().lower()] = ':'.join(parts[1:]).strip().lower()
+    method, path, ver = lines[0].decode().split(' ')
+    return method, path, ver, headers
+
+
+async def buffered(stream):
+    head = await srv.Reader(stream).readHead(65536)
+    return srv.parseHead(head, 100)
+
+
+async def run(fn, n):
+    calls = 0
+    start = time.perf_counter()
+    for _ in range(n):
+        stream = FakeStream(REQ)
+        await fn(stream)
+        calls += stream.calls
+    took = time.perf_counter() - start
+    return n / took, calls / n
+
+
+async def main(n):
+    assert await legacy(FakeStream(REQ)) == await buffered(FakeStream(REQ))
+    for name, fn in (('byte-at-a-time', legacy), ('buffered', buffered)):
+        rps, calls = await run(fn, n)
+        print(f'{name:>15}: {rps:>10.0f} req/s, {calls:.0f} receive_some calls/req')
+
+
+if __name__ == '__main__':
+    trio.run(main, int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,63 @@
+# md2html.incremental against rendering the whole document: how long a render (md2html and
+# generating the html, like the server does) takes after a one character edit somewhere in it (with
+# the blocks of the old version cached), and that the html, titles and attrs come out exactly the
+# same as from a full render
+# run from the repo root with ``python -m bench.incremental [--edits 20] [--scale 1]``
+# exits with 1 if any output differs
+import argparse
+import random
+import sys
+import time
+
+import md2html
+from bench.render import cases
+from bench.tokenizer import quiet
+
+
+def render(cont: str, incremental: bool):
+    md2html.incremental = incremental
+    with quiet():
+        start = time.perf_counter()
+        page = md2html.md2html(cont)
+        html = page.generate()
+        took = time.perf_counter() - start
+    return (html, page.titles, [*page.attrs.items()]), took
+
+
+def edit(rng: random.Random, cont: str):
+    n = rng.randrange(len(cont) + 1)
+    return cont[:n] + rng.choice('x *#-|\n') + cont[n:]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--edits', type=int, default=20, help='edits to every document')
+    parser.add_argument('--scale', type=float, default=1, help='size of the generated cases (1 is 64kb)')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    wrong = 0
+    print(f'{"case":>34} {"chars":>8} {"full ms":>10} {"cold ms":>10} {"edit ms":>10} {"speedup":>8}')
+    for name, cont in cases(args.scale).items():
+        md2html.blockCache.clear()
+        _, cold = render(cont, True)
+        fulls, edits = [], []
+        for _ in range(args.edits):
+            cont = edit(rng, cont)
+            want, took = render(cont, False)
+            fulls.append(took)
+            got, took = render(cont, True)
+            edits.append(took)
+            wrong += got != want
+        full, inc = sum(fulls) / len(fulls), sum(edits) / len(edits)
+        print(
+            f'{name:>34} {len(cont):>8} {full * 1000:>10.2f} {cold * 1000:>10.2f}'
+            f' {inc * 1000:>10.2f} {full / inc:>7.1f}x'
+        )
+
+    print(f'{wrong} renders differed from a full render')
+    sys.exit(1 if wrong else 0)
+
+
+if __name__ == '__main__':
+    main()
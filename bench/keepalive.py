@@ -0,0 +1,76 @@
+# page-load latency with a fresh connection per resource vs keep-alive vs pipelining
+# run from the repo root with ``python -m bench.keepalive [page] [views]``
+import os
+import re
+import sys
+import time
+
+import trio
+
+import srv
+from bench.client import Conn, get, percentile, serveDir, startServer
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def resources(html: bytes):
+    # everything the browser would fetch after the page itself
+    found = re.findall(rb'(?:src|href)="([^"#:]+)"', html)
+    return ['/' + p.decode().lstrip('/') for p in found if not p.endswith(b'.html')]
+
+
+async def perResource(port, page, res):
+    await get('127.0.0.1', port, page)
+    for p in res:
+        await get('127.0.0.1', port, p)
+
+
+async def keepAlive(port, page, res):
+    conn = await Conn.open('127.0.0.1', port)
+    await conn.get(page)
+    for p in res:
+        await conn.get(p)
+    await conn.aclose()
+
+
+async def pipelined(port, page, res):
+    conn = await Conn.open('127.0.0.1', port)
+    await conn.get(page)
+    await conn.pipeline(res)
+    await conn.aclose()
+
+
+async def main(page, views):
+    server = srv.Server(host='127.0.0.1')
+    server.maxRequests = 1000
+    await serveDir(server, os.path.join(root, 'static'))
+
+    async with trio.open_nursery() as nurs:
+        port = await startServer(server, nurs)
+        _, _, html = await get('127.0.0.1', port, page)
+        res = resources(html)
+        print(f'{page}: {len(res)} sub-resources {res}')
+
+        for name, fn in (
+            ('connection per resource', perResource),
+            ('keep-alive', keepAlive),
+            ('keep-alive + pipelining', pipelined),
+        ):
+            samples = []
+            for _ in range(views):
+                start = time.perf_counter()
+                await fn(port, page, res)
+                samples.append(time.perf_counter() - start)
+            print(
+                f'{name:>24}: mean {sum(samples) / views * 1000:7.2f}ms'
+                f'  p50 {percentile(samples, .5) * 1000:7.2f}ms'
+                f'  p99 {percentile(samples, .99) * 1000:7.2f}ms'
+            )
+
+        nurs.cancel_scope.cancel()
+
+
+if __name__ == '__main__':
+    page = sys.argv[1] if len(sys.argv) > 1 else '/fritior-nansen.html'
+    views = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    trio.run(main, page, views)
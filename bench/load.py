@@ -0,0 +1,180 @@
+# load test for srv.Server: requests/sec, latency percentiles and errors at a few concurrency
+# levels, with and without keep-alive, for a mix of requests over the static/ tree, 404s and a big
+# file. the server runs in its own process on a loopback port, so it doesnt share a trio loop (or
+# the gil) with the clients
+# run from the repo root with
+#   ``python -m bench.load [--concurrency 1,16,64] [--duration 5] [--mix static=90,404=5,big=5]``
+# exits with 1 if there were any errors, so it can run in ci
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import trio
+
+import srv
+from bench.client import Conn, serveDir
+from metrics import Histogram
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+staticPath = os.path.join(root, 'static')
+# what every kind of request should get back, anything else is an error
+expected = {'static': 200, '404': 404, 'big': 200}
+
+
+async def serve(big: str, maxRequests: int):
+    server = srv.Server(host='127.0.0.1', port=0, maxRequests=maxRequests, accessLog=False)
+    await serveDir(server, staticPath)
+    server.streamServe(big, '/big.bin')
+    sock = server.listenSocket()
+    print(sock.getsockname()[1], flush=True)
+    await server.start(sock)
+
+
+def urls(origin=staticPath, prefix=''):
+    out = []
+    for file in sorted(os.listdir(origin)):
+        if os.path.isdir(path := os.path.join(origin, file)):
+            out += urls(path, prefix + '/' + file)
+        else:
+            out.append(prefix + '/' + file)
+    return out
+
+
+class Stats:
+    def __init__(self):
+        self.latency = Histogram()
+        self.statuses: dict[int, int] = {}
+        self.errors = 0
+        self.bytes = 0
+
+
+def pick(rng: random.Random, mix, static: list[str]):
+    kind = rng.choices([*mix], [*mix.values()])[0]
+    if kind == 'static':
+        return kind, rng.choice(static)
+    if kind == '404':
+        return kind, f'/nope/{rng.random()}'
+    return kind, '/big.bin'
+
+
+async def client(port, mix, static, keep: bool, deadline: float, stats: Stats, rng: random.Random):
+    conn = None
+    while trio.current_time() < deadline:
+        kind, path = pick(rng, mix, static)
+
+        start = time.perf_counter()
+        try:
+            if conn is None:
+                conn = await Conn.open('127.0.0.1', port)
+            status, headers, body = await conn.get(path, {} if keep else {'Connection': 'close'})
+        except (OSError, ConnectionError, trio.BrokenResourceError):
+            stats.errors += 1
+            if conn is not None:
+                await conn.aclose()
+            conn = None
+            continue
+        stats.latency.record(time.perf_counter() - start)
+        stats.statuses[status] = stats.statuses.get(status, 0) + 1
+        stats.bytes += len(body)
+        if status != expected[kind]:
+            stats.errors += 1
+
+        # NOTE: the server closes keep-alive connections after maxRequests, or when its busy
+        if not keep or headers.get('connection') == 'close':
+            await conn.aclose()
+            conn = None
+
+    if conn is not None:
+        await conn.aclose()
+
+
+async def load(port, mix, keep: bool, concurrency: int, duration: float):
+    stats = Stats()
+    static = urls()
+    start = time.perf_counter()
+    deadline = trio.current_time() + duration
+    async with trio.open_nursery() as nurs:
+        for n in range(concurrency):
+            nurs.start_soon(client, port, mix, static, keep, deadline, stats, random.Random(n))
+    took = time.perf_counter() - start
+
+    l = stats.latency
+    return {
+        'keepAlive': keep,
+        'concurrency': concurrency,
+        'requests': l.count,
+        'rps': l.count / took,
+        'MBps': stats.bytes / took / 1e6,
+        'p50': l.percentile(0.5),
+        'p99': l.percentile(0.99),
+        'p999': l.percentile(0.999),
+        'errors': stats.errors,
+        'statuses': stats.statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', default='1,16,64', help='comma separated client counts')
+    parser.add_argument('--duration', type=float, default=5, help='seconds for every run')
+    parser.add_argument(
+        '--mix', default='static=90,404=5,big=5', help='weights of the request kinds (static/404/big)'
+    )
+    parser.add_argument('--keepalive', choices=('on', 'off', 'both'), default='both')
+    parser.add_argument('--big', type=int, default=8, help='size of /big.bin in MB')
+    parser.add_argument('--max-requests', type=int, default=100, help="the server's maxRequests")
+    parser.add_argument('--out', help='save the results to this json file')
+    parser.add_argument('--serve', help=argparse.SUPPRESS)  # the server process
+    args = parser.parse_args()
+
+    if args.serve:
+        trio.run(serve, args.serve, args.max_requests)
+        return
+
+    mix = {}
+    for part in args.mix.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in expected:
+            parser.error(f'unknown request kind {kind!r}, pick from {", ".join(expected)}')
+        mix[kind] = float(weight or 1)
+    keeps = {'on': [True], 'off': [False], 'both': [True, False]}[args.keepalive]
+
+    results = []
+    with tempfile.NamedTemporaryFile(suffix='.bin') as big:
+        big.write(os.urandom(args.big << 20))
+        big.flush()
+        cmd = [sys.executable, '-m', 'bench.load', '--serve', big.name]
+        cmd += ['--max-requests', str(args.max_requests)]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+        try:
+            port = int(proc.stdout.readline())
+            print(
+                f'{"keep-alive":>10} {"clients":>7} {"requests":>8} {"req/s":>9} {"MB/s":>8}'
+                f' {"p50 ms":>8} {"p99 ms":>8} {"p999 ms":>8} {"errors":>6}'
+            )
+            for keep in keeps:
+                for concurrency in map(int, args.concurrency.split(',')):
+                    res = trio.run(load, port, mix, keep, concurrency, args.duration)
+                    results.append(res)
+                    print(
+                        f'{"on" if keep else "off":>10} {concurrency:>7} {res["requests"]:>8}'
+                        f' {res["rps"]:>9.1f} {res["MBps"]:>8.1f} {res["p50"] * 1000:>8.2f}'
+                        f' {res["p99"] * 1000:>8.2f} {res["p999"] * 1000:>8.2f} {res["errors"]:>6}'
+                    )
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'mix': mix, 'duration': args.duration, 'results': results}, f, indent=1)
+    sys.exit(1 if any(r['errors'] for r in results) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+# how much the genweb trees for content/ cost: nodes, memory held by the finished trees, and peak
+# memory while rendering (all from tracemalloc)
+# run from the repo root with ``python -m bench.nodes``
+import time
+import tracemalloc
+
+import genweb as w
+import md2html
+import profiling
+from bench.tokenizer import docs, quiet
+
+
+def main():
+    content = docs()
+
+    pages = {}
+    with quiet():
+        start = time.perf_counter()
+        for name, cont in content.items():
+            md2html.md2html(cont)
+        took = time.perf_counter() - start
+
+        tracemalloc.start()
+        for name, cont in content.items():
+            pages[name] = md2html.md2html(cont)
+        held, peak = tracemalloc.get_traced_memory()
+        snap = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+    nodes = sum(profiling.nodes(w.Joined([p.head, p.body])) for p in pages.values())
+    blocks = sum(s.count for s in snap.statistics('filename'))
+    print(f'{len(pages)} pages rendered in {took * 1000:.1f}ms')
+    print(f'{nodes} nodes, the pages hold {blocks} blocks, {held / 1024:.0f}KiB')
+    print(f'peak while rendering {peak / 1024:.0f}KiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# md2html.buildTree on growing synthetic markdown (up to 1mb), with and without packrat
+# run from the repo root with ``python -m bench.packrat``
+import random
+import sys
+import time
+
+import md2html
+
+words = 'the quick brown fox jumps over lazy dog 5 = 15 a-b c|d'.split(' ')
+
+
+def doc(size: int, seed=0):
+    # headings, lists, quotes and some bold text, with ``***`` as a section separator (which the
+    # ``***`` rule keeps trying to close all the way to the end of the document)
+    rng = random.Random(seed)
+    out = []
+    n = 0
+    while n < size:
+        k = rng.random()
+        if k < 0.1:
+            line = '## ' + ' '.join(rng.choices(words, k=4)) + ' {sec' + str(n) + '}'
+        elif k < 0.2:
+            line = '\n'.join('- ' + ' '.join(rng.choices(words, k=6)) for _ in range(3))
+        elif k < 0.3:
+            line = '> ' + ' '.join(rng.choices(words, k=10))
+        else:
+            line = ' '.join(
+                '**' + w + '**' if rng.random() < 0.05 else w for w in rng.choices(words, k=40)
+            )
+        if rng.random() < 0.05:
+            line += '\n\n***'
+        out.append(line + '\n\n')
+        n += len(line) + 2
+    return ''.join(out)
+
+
+def parse(toks, packrat: bool):
+    md2html.packrat = packrat
+    start = time.perf_counter()
+    body = md2html.buildTree(toks, md2html.Page())
+    return time.perf_counter() - start, body
+
+
+def main():
+    # the old parser is quadratic here, so it gets skipped once it gets too slow
+    limit = float(sys.argv[1]) if len(sys.argv) > 1 else 30
+
+    print(f'{"size":>8} {"tokens":>8} {"before":>9} {"after":>9}')
+    before = 0
+    for kb in (16, 32, 64, 128, 256, 512, 1024):
+        toks = md2html.tokenize('\n' + md2html.postproc(doc(kb * 1024)) + '\n')
+        after, body = parse(toks, True)
+        if before < limit:
+            before, old = parse(toks, False)
+            assert old.generate() == body.generate(), 'packrat changed the output'
+            shown = f'{before:>8.2f}s'
+        else:
+            shown = f'{"-":>9}'
+        print(f'{kb:>6}kb {len(toks):>8} {shown} {after:>8.2f}s')
+    md2html.packrat = True
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# genall --jobs on a synthetic site of 1000 pages: wall time at 1, 2, 4 and 8 worker processes next
+# to the plain one page after another loop, and a check that every run writes the same files
+# run from the repo root with ``python -m bench.parallel [pages]``
+# NOTE: the speedup is capped by the number of cores, there are os.cpu_count() of them here
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+import genall
+from bench.packrat import doc
+
+
+def site(path, pages):
+    # a few kb each, about the size of the real pages
+    paths = []
+    for n in range(pages):
+        paths.append(os.path.join(path, f'page{n:04}.md'))
+        with open(paths[-1], 'w') as f:
+            f.write(f'-attr: title = page {n}\n-attr: _metaauthor = bench\n' + doc(4096, seed=n))
+    return paths
+
+
+def digest(outDir):
+    h = hashlib.sha256()
+    for file in sorted(os.listdir(outDir)):
+        with open(os.path.join(outDir, file), 'rb') as f:
+            h.update(file.encode() + b'\0' + f.read())
+    return h.hexdigest()
+
+
+def main(pages):
+    # md2html prints the attrs of every page, the workers inherit our stdout so it goes to devnull
+    out = os.fdopen(os.dup(1), 'w', buffering=1)
+    with open(os.devnull, 'w') as devnull:
+        os.dup2(devnull.fileno(), 1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = site(tmp, pages)
+        print(f'{pages} pages on {os.cpu_count()} cores', file=out)
+        print(f'{"jobs":>6} {"time":>8} {"pages/s":>8} {"speedup":>8}', file=out)
+
+        runs = {'serial': None, **{jobs: jobs for jobs in (1, 2, 4, 8)}}
+        want = base = None
+        for name, jobs in runs.items():
+            outDir = os.path.join(tmp, f'out-{name}')
+            os.mkdir(outDir)
+            start = time.perf_counter()
+            if jobs is None:
+                for fpath in paths:
+                    genall.buildPage(fpath, (), outDir, cached=False)
+            else:
+                for _ in genall.buildPool(paths, (), jobs, outDir, cached=False):
+                    pass
+            took = time.perf_counter() - start
+
+            got = digest(outDir)
+            assert want in (None, got), f'{name} jobs wrote different files'
+            want, base = got, base or took
+            print(f'{name:>6} {took:>7.2f}s {pages / took:>8.0f} {base / took:>7.2f}x', file=out)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,169 @@
+# md2html and genweb stage by stage (tokenize, buildTree, the whole md2html and Tag.generate) over
+# content/ and some generated worst cases, saved as json so two runs can be compared
+# run from the repo root with
+#   ``python -m bench.render run [--out results.json] [--runs 5] [--scale 1]``
+#   ``python -m bench.render compare old.json new.json [--threshold 10]``
+# compare exits with 1 if anything got slower than the threshold (in percent), so it can gate ci
+# NOTE: only compare runs from the same (quiet) machine, on a shared box the noise is way over 10%
+import argparse
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+
+import genweb as w
+import md2html
+from bench.packrat import doc, words
+from bench.tokenizer import docs, quiet
+
+stages = ('tokenize', 'buildTree', 'md2html', 'generate')
+
+
+def nested(size: int, depth=40):
+    # lists going all the way down to ``depth`` levels and back up, over and over
+    out, n = [], 0
+    levels = [*range(1, depth + 1), *range(depth - 1, 1, -1)]
+    while n < size:
+        for l in levels:
+            out.append('-' * l + ' ' + ' '.join(words[:6]))
+            n += len(out[-1]) + 1
+    return '\n'.join(out) + '\n'
+
+
+def table(size: int, columns=4):
+    # one huge table for the vertical rule
+    out, n = [], 0
+    while n < size:
+        row = ' | '.join(f'cell {len(out)}.{k} ' + ' '.join(words[k : k + 3]) for k in range(columns))
+        out.append(row)
+        n += len(row) + 1
+    return '\n'.join(out) + '\n'
+
+
+def stars(size: int):
+    # ``***`` that (mostly) never get closed, next to bold and italic runs that do
+    unit = '***a **b *c d** e* f *** g ***h*** i **j *k** l* \n'
+    return unit * (size // len(unit))
+
+
+def codeBlock(size: int):
+    line = 'for (int i = 0; i < n; i++) { *p++ = **q ^ (i | 0x5f) ~ i; } // [x](y) # z\n'
+    return '```\n' + line * (size // len(line)) + '```\n'
+
+
+def cases(scale: float):
+    out = {f'content/{file}': cont for file, cont in docs().items()}
+    size = int(64 * 1024 * scale)
+    out['mixed'] = doc(size)
+    out['nested-lists'] = nested(size)
+    out['long-table'] = table(size)
+    out['star-runs'] = stars(size)
+    out['code-block'] = codeBlock(4 * size)
+    return out
+
+
+def best(fn, runs: int):
+    # NOTE: the collector going off in the middle of a run is most of the noise between runs
+    times = []
+    for _ in range(runs):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return {'min': min(times), 'median': statistics.median(times)}
+
+
+def measure(cont: str, runs: int):
+    text = '\n' + md2html.postproc(cont) + '\n'
+    toks = md2html.tokenize(text)
+    page = md2html.md2html(cont)
+    root = w.Joined([page.head, page.body])
+    return {
+        'tokenize': best(lambda: md2html.tokenize(text), runs),
+        'buildTree': best(lambda: md2html.buildTree(toks, md2html.Page()), runs),
+        'md2html': best(lambda: md2html.md2html(cont), runs),
+        'generate': best(root.generate, runs),
+        'chars': len(cont),
+    }
+
+
+def run(args):
+    results = {}
+    for name, cont in cases(args.scale).items():
+        with quiet():
+            results[name] = measure(cont, args.runs)
+        times = ' '.join(f'{results[name][s]["min"] * 1000:>12.2f}' for s in stages)
+        print(f'{name:>34} {len(cont):>8} {times}')
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(
+                {
+                    'python': sys.version.split()[0],
+                    'machine': platform.platform(),
+                    'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'runs': args.runs,
+                    'scale': args.scale,
+                    'results': results,
+                },
+                f,
+                indent=1,
+            )
+        print(f'saved to {args.out}')
+
+
+def compare(args):
+    with open(args.old) as f:
+        old = json.load(f)['results']
+    with open(args.new) as f:
+        new = json.load(f)['results']
+
+    worse = 0
+    print(f'{"case":>34} {"stage":>10} {"old ms":>10} {"new ms":>10} {"change":>8}')
+    for name in sorted(old.keys() & new.keys()):
+        for s in stages:
+            a, b = old[name][s]['min'], new[name][s]['min']
+            change = (b - a) / a * 100
+            # NOTE: a few percent of a millisecond is just noise
+            slower = change > args.threshold and b - a > args.floor / 1000
+            worse += slower
+            flag = '  <- slower' if slower else ''
+            print(f'{name:>34} {s:>10} {a * 1000:>10.2f} {b * 1000:>10.2f} {change:>+7.1f}%{flag}')
+    for name in sorted(old.keys() ^ new.keys()):
+        print(f'{name:>34} only in {"the old" if name in old else "the new"} run')
+
+    print(f'{worse} regressions over {args.threshold}%')
+    return 1 if worse else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='cmd', required=True)
+
+    p = sub.add_parser('run')
+    p.add_argument('--out', help='save the results to this json file')
+    p.add_argument('--runs', type=int, default=5, help='take the best of this many runs')
+    p.add_argument('--scale', type=float, default=1, help='size of the generated cases (1 is 64kb)')
+
+    p = sub.add_parser('compare')
+    p.add_argument('old')
+    p.add_argument('new')
+    p.add_argument('--threshold', type=float, default=10, help='percent slower that counts')
+    p.add_argument('--floor', type=float, default=1, help='ms slower that counts')
+
+    args = parser.parse_args()
+    if args.cmd == 'run':
+        print(f'{"case":>34} {"chars":>8} ' + ' '.join(f'{s + " ms":>12}' for s in stages))
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# route lookup cost as the number of registered static paths grows: old dict walk vs Router
+# run from the repo root with ``python -m bench.router``
+import random
+import time
+
+from router import Router, split
+
+
+class Walk:
+    # this is how Server.handler/getHandler used to store and find routes
+    def __init__(self):
+        self.tree = {}
+
+    def add(self, path, f):
+        cur = self.tree
+        for part in split(path):
+            if part not in cur:
+                cur[part] = {}
+            cur = cur[part]
+        cur[''] = f
+
+    def get(self, path: str):
+        cur = self.tree
+        for part in path.split('/'):
+            if not (new := cur.get(part)) and not (new := cur.get('%')):
+                if not (cur := cur.get('%%')):
+                    return None
+                break
+            cur = new
+        return cur.get('')
+
+
+def paths(n):
+    # something that looks like a static/ tree: a few directories deep, lots of files
+    rng = random.Random(n)
+    out = []
+    for i in range(n):
+        depth = rng.randint(0, 3)
+        dirs = [f'd{rng.randint(0, 20)}' for _ in range(depth)]
+        out.append('/'.join([*dirs, f'file{i}.html']))
+    return out
+
+
+def bench(get, lookups):
+    start = time.perf_counter()
+    for p in lookups:
+        get(p)
+    return (time.perf_counter() - start) / len(lookups) * 1e9
+
+
+def main():
+    print(f'{"routes":>7} {"walk hit":>10} {"router hit":>11} {"walk wild":>10} {"router wild":>12}')
+    for n in (100, 1000, 10000, 100000):
+        ps = paths(n)
+        walk, router = Walk(), Router()
+        for p in ps:
+            walk.add(p, p)
+            router.add(p, p)
+        for r in (walk, router):
+            r.add('api/%/info', 'api')
+            r.add('files/%%', 'files')
+
+        rng = random.Random(0)
+        hits = [rng.choice(ps) for _ in range(200000)]
+        wild = [rng.choice(['api/x/info', 'files/a/b/c.png']) for _ in range(200000)]
+        assert all(walk.get(p) == router.get(p)[0] for p in hits[:1000] + wild[:1000])
+
+        print(
+            f'{n:>7} {bench(walk.get, hits):>8.0f}ns {bench(router.get, hits):>9.0f}ns'
+            f' {bench(walk.get, wild):>8.0f}ns {bench(router.get, wild):>10.0f}ns'
+        )
+
+
+if __name__ == '__main__':
+    main()
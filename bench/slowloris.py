@@ -0,0 +1,77 @@
+# latency of normal requests while thousands of idle / slow-loris sockets sit on the server
+# run from the repo root with ``python -m bench.slowloris [idle|trickle] [sockets]``
+import resource
+import sys
+import time
+
+import trio
+
+import srv
+from bench.client import get, percentile, startServer
+
+
+async def idle(port, opened: list):
+    # connect and never say anything
+    s = await trio.open_tcp_stream('127.0.0.1', port)
+    opened.append(s)
+    await trio.sleep_forever()
+
+
+async def trickle(port, opened: list):
+    # the classic slow-loris: a request head that never ends, one header every second
+    s = await trio.open_tcp_stream('127.0.0.1', port)
+    opened.append(s)
+    try:
+        await s.send_all(b'GET / HTTP/1.1\r\n')
+        while True:
+            await trio.sleep(1)
+            await s.send_all(b'X-a: b\r\n')
+    except trio.BrokenResourceError:
+        await trio.sleep_forever()  # the server cut us off, which is the point
+
+
+async def measure(port, n):
+    samples, errors = [], 0
+    for _ in range(n):
+        start = time.perf_counter()
+        try:
+            status, _, _ = await get('127.0.0.1', port, '/')
+            errors += status != 200
+        except (OSError, trio.BrokenResourceError, ConnectionError):
+            errors += 1
+        samples.append(time.perf_counter() - start)
+    return (
+        f'p50 {percentile(samples, .5) * 1000:7.2f}ms  p99 {percentile(samples, .99) * 1000:7.2f}ms'
+        f'  errors {errors}/{n}'
+    )
+
+
+async def main(mode, count):
+    server = srv.Server(host='127.0.0.1', maxConnections=512, headerTimeout=10)
+    server.genericServe(b'<p>hello</p>', '/')
+    attack = {'idle': idle, 'trickle': trickle}[mode]
+
+    async with trio.open_nursery() as nurs:
+        port = await startServer(server, nurs)
+        print(f'      baseline: {await measure(port, 200)}')
+
+        opened = []
+        for _ in range(count):
+            nurs.start_soon(attack, port, opened)
+        while len(opened) < count:
+            await trio.sleep(0.1)
+        await trio.sleep(1)
+        print(
+            f'{count} {mode} sockets open, server holds'
+            f' {server.limiter.borrowed_tokens}/{server.limiter.total_tokens} slots'
+        )
+        print(f'  under attack: {await measure(port, 200)}')
+        nurs.cancel_scope.cancel()
+
+
+if __name__ == '__main__':
+    # NOTE: client and server share this process, so we need two fds per socket
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    mode = sys.argv[1] if len(sys.argv) > 1 else 'idle'
+    trio.run(main, mode, int(sys.argv[2]) if len(sys.argv) > 2 else 3000)
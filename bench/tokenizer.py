@@ -0,0 +1,165 @@
+# md2html.tokenize against the old per-char scan over every token: first checks that both give
+# the same tokens (and the same html) for everything in content/, then compares chars/sec
+# run from the repo root with ``python -m bench.tokenizer``
+import contextlib
+import io
+import os
+import time
+
+import md2html
+from md2html import ListIO, Tokens, postproc
+from md2html import ib, b, i, st, sub, u, sup, details, exp, br, cb, sc, refStart, refEnd
+from md2html import h4, h3, h2, h1, fishl, fishr, attr, le, url, uclose, img, close
+from md2html import idStart, idEnd, bqoute, vsep, space, backslash, c
+
+contentPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'content')
+
+
+def docs():
+    # everything in content/, by file name
+    out = {}
+    for file in sorted(os.listdir(contentPath)):
+        with open(os.path.join(contentPath, file)) as f:
+            out[file] = f.read()
+    return out
+
+
+def quiet():
+    # for around md2html, it prints the attrs of every page
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def simple(s):
+    return lambda buf: buf.read(len(s)) == s
+
+
+def quote(q):
+    def check(buf: ListIO):
+        if buf.read(len(q)) != q:
+            return False
+        o = ''
+        while not o.endswith(q):
+            if buf.ended():
+                return False
+            o += buf.read(1)[0]
+        return True
+
+    return check
+
+
+def _bs(buf: ListIO):
+    if buf.read(1) != '\\':
+        return False
+    buf.read(1)
+    return True
+
+
+def _c(buf: ListIO):
+    buf.read(1)
+    return True
+
+
+# this is how md2html.tokenize used to work
+linear = {
+    ib: simple('***'),
+    b: simple('**'),
+    i: simple('*'),
+    st: simple('~~'),
+    sub: simple('~'),
+    u: simple('__'),
+    sup: simple('^'),
+    details: simple('///'),
+    exp: simple('//'),
+    br: simple('\n'),
+    cb: simple('```'),
+    sc: quote('``'),
+    refStart: simple('['),
+    refEnd: simple(']'),
+    h4: simple('####'),
+    h3: simple('###'),
+    h2: simple('##'),
+    h1: simple('#'),
+    fishl: simple('&lt;-|'),
+    fishr: simple('|-&gt;'),
+    attr: simple('-attr:'),
+    le: simple('-'),
+    url: simple('url['),
+    uclose: simple(']'),
+    img: simple('img('),
+    close: simple(')'),
+    idStart: simple('{'),
+    idEnd: simple('}'),
+    bqoute: simple('&gt;'),
+    vsep: simple('|'),
+    space: simple(' '),
+    backslash: _bs,
+    c: _c,
+}
+
+
+def linearTokenize(cont: str) -> Tokens:
+    buf = ListIO(cont)
+    toks = []
+    while not buf.ended():
+        for tok, check in linear.items():
+            oldc = buf.c
+            if check(buf):
+                toks.append((tok, buf.l[oldc : buf.c]))
+                break
+            buf.c = oldc
+    return Tokens.of(toks)
+
+
+def merged(toks: Tokens):
+    # the old tokenizer made a ``c`` for every char, the new one joins the runs
+    out = []
+    for tok, data in toks.pairs():
+        if tok == c and out and out[-1][0] == c:
+            out[-1] = (c, out[-1][1] + data)
+        else:
+            out.append((tok, data))
+    return out
+
+
+def render(cont: str, tokenize):
+    old = md2html.tokenize
+    md2html.tokenize = tokenize
+    try:
+        with quiet():
+            return md2html.md2html(cont).generate()
+    finally:
+        md2html.tokenize = old
+
+
+def golden(docs: dict[str, str]):
+    for name, cont in docs.items():
+        text = '\n' + postproc(cont) + '\n'
+        want = merged(linearTokenize(text))
+        got = [*md2html.tokenize(text).pairs()]
+        assert got == want, f'{name}: token streams differ'
+        assert render(cont, md2html.tokenize) == render(cont, linearTokenize), f'{name}: html differs'
+    print(f'{len(docs)} documents tokenize and render the same')
+
+
+def rate(tokenize, text: str, runs=3):
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        tokenize(text)
+        best = min(best, time.perf_counter() - start)
+    return len(text) / best
+
+
+def main():
+    content = docs()
+    golden(content)
+
+    print(f'{"document":>26} {"chars":>7} {"linear c/s":>12} {"regex c/s":>12} {"speedup":>8}')
+    for name, cont in content.items():
+        text = '\n' + postproc(cont) + '\n'
+        old, new = rate(linearTokenize, text), rate(md2html.tokenize, text)
+        print(f'{name:>26} {len(text):>7} {old:>12.0f} {new:>12.0f} {new / old:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
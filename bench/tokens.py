@@ -0,0 +1,50 @@
+# peak RSS and time for tokenizing and parsing a big synthetic document with the compact token
+# streams, next to what one object per token (like md2html used to make) costs
+# run from the repo root with ``python -m bench.tokens [size in MB]``
+# every mode runs in its own process, so the peak RSS numbers dont leak into each other
+import resource
+import subprocess
+import sys
+import time
+
+import md2html
+from bench.packrat import doc
+
+
+class Boxed:
+    # the old md2html.Token: a name and the text, for every single token
+    def __init__(self, name: str, data: str):
+        self.name = name
+        self.data = data
+
+
+def child(mode, mb):
+    text = '\n' + md2html.postproc(doc(int(mb * 1024 * 1024))) + '\n'
+    base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    toks = md2html.tokenize(text)
+    if mode == 'objects':
+        toks = [Boxed(tok.name, data) for tok, data in toks.pairs()]
+    elif mode == 'parse':
+        md2html.buildTree(toks, md2html.Page())
+    took = time.perf_counter() - start
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        f'{mode:>8}: {len(toks):>8} tokens {took:7.2f}s,'
+        f' peak RSS +{(peak - base) / 1024:6.1f} MB over a {base / 1024:.1f} MB baseline'
+    )
+
+
+def main(mb):
+    print(f'{mb}mb of markdown')
+    for mode in ('objects', 'tokenize', 'parse'):
+        subprocess.run([sys.executable, '-m', 'bench.tokens', '--child', mode, str(mb)], check=True)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2], float(sys.argv[3]))
+    else:
+        main(float(sys.argv[1]) if len(sys.argv) > 1 else 5)
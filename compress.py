@@ -0,0 +1,76 @@
+import gzip
+
+# brotli and zstd are optional, gzip is always there
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+encoders = {}
+if brotli:
+    encoders['br'] = lambda cont: brotli.compress(cont, quality=11)
+if zstandard:
+    encoders['zstd'] = lambda cont: zstandard.ZstdCompressor(level=19).compress(cont)
+# NOTE: mtime=0 so the output (and its etag) only depends on the content
+encoders['gzip'] = lambda cont: gzip.compress(cont, 9, mtime=0)
+
+# file extensions for the precompressed copies genall writes next to the html
+extensions = {'br': '.br', 'zstd': '.zst', 'gzip': '.gz'}
+
+# anything not listed here (images, video, fonts, archives, ...) is already compressed
+compressible = (
+    'text/',
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'application/xhtml+xml',
+    'image/svg+xml',
+)
+
+minSize = 256  # smaller than this, the headers cost more than we save
+
+
+def shouldCompress(ctype: str, size: int):
+    return size >= minSize and ctype.startswith(compressible)
+
+
+def variants(cont: bytes, ctype: str):
+    # every encoding that actually makes ``cont`` smaller
+    if not shouldCompress(ctype, len(cont)):
+        return {}
+    out = {}
+    for enc, fn in encoders.items():
+        if len(data := fn(cont)) < len(cont):
+            out[enc] = data
+    return out
+
+
+def negotiate(accept: str, available):
+    # pick the encoding the client wants most out of ``available``, ties go to the order of
+    # ``encoders`` (best compression first). None means identity
+    prefs = {}
+    for part in accept.split(','):
+        name, _, params = part.partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            key, _, val = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(val)
+                except ValueError:
+                    q = 0
+        prefs[name.strip()] = q
+
+    best, bestq = None, 0
+    for enc in encoders:
+        if enc not in available:
+            continue
+        if (q := prefs.get(enc, prefs.get('*', 0))) > bestq:
+            best, bestq = enc, q
+    return best
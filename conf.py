@@ -1,17 +1,21 @@
+import inspect
 import os
 from srv import Server
 import traceback
+import trio
 
 root = os.path.dirname(os.path.abspath(__file__))
 server = Server(port=8080)
 initers = []
+# initers that write files (and so would race each other) only run in one worker
+singleIniters = []
 
 
 def start_soon(nurs, fn, *a):
     async def new():
         try:
             await fn(*a)
-        except:
+        except Exception:
             traceback.print_exc()
 
     nurs.start_soon(new)
@@ -20,3 +24,21 @@ def start_soon(nurs, fn, *a):
 def initer(fn):
     initers.append(fn)
     return fn
+
+
+def singleIniter(fn):
+    singleIniters.append(fn)
+    return fn
+
+
+# NOTE: trio 0.23 renamed ``cancellable`` to ``abandon_on_cancel``
+_abandon = (
+    "abandon_on_cancel"
+    if "abandon_on_cancel" in inspect.signature(trio.to_thread.run_sync).parameters
+    else "cancellable"
+)
+
+
+async def runThread(fn, *a):
+    # the inotify loops block forever, so shutting down has to leave their threads behind
+    return await trio.to_thread.run_sync(fn, *a, **{_abandon: True})
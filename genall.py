@@ -1,13 +1,28 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
 import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import trio
 
+import compress
 import genweb as w
+import pagecache
+import profiling
 from md2html import Page, md2html
+from profiling import phase
 
 curdir = os.path.join(os.path.dirname(os.path.abspath(__file__)))
 blogPath = os.path.join(curdir, "content")
 generatedBlogPath = os.path.join(curdir, "static")
+# what every page was built from, so the next run can skip the ones that didnt change
+manifestPath = os.path.join(curdir, ".build", "manifest.json")
+# rendered pages by the hash of their source, shared with the server
+pages = pagecache.PageCache()
 
 
 def transform(p: Page):
@@ -18,18 +33,74 @@ def transform(p: Page):
     ]
 
 
-async def makePost(path, force=False):
-    outPath = os.path.join(generatedBlogPath, os.path.basename(path))[:-3] + ".html"
-    async with await trio.open_file(path, "r") as f:
-        out = md2html(await f.read())
-        transform(out)
+def outputOf(path, outDir=generatedBlogPath):
+    return os.path.join(outDir, os.path.basename(path))[:-3] + ".html"
+
+
+def compressPage(outPath, encodings):
+    # precompressed copies, for hosts that can serve them as is
+    with open(outPath, "rb") as f:
+        cont = f.read()
+    for enc in encodings:
+        with open(outPath + compress.extensions[enc], "wb") as f:
+            f.write(compress.encoders[enc](cont))
+    # and dont leave copies of an older version around
+    for enc, ext in compress.extensions.items():
+        if enc not in encodings and os.path.exists(outPath + ext):
+            os.remove(outPath + ext)
+
+
+async def makePost(path, force=False, encodings=(), cached=True):
+    outPath = outputOf(path)
     if not force and os.path.exists(outPath):
         return outPath
-    async with await trio.open_file(outPath, "w+") as f:
-        await f.write(out.generate())
+    await trio.to_thread.run_sync(buildPage, path, encodings, generatedBlogPath, cached)
     return outPath
 
 
+def buildPage(fpath, encodings, outDir=generatedBlogPath, cached=True):
+    # a whole page, from the markdown to the compressed copies. this is what makePost and the
+    # --jobs workers run
+    outPath = outputOf(fpath, outDir)
+    with phase(f"page:{os.path.basename(fpath)}"):
+        with phase("read"), open(fpath, "rb") as f:
+            source = f.read()
+        key = pages.key(source, pagecache.rendererHash(transform))
+        if cached and (hit := pages.reader(key)) is not None:
+            with hit[0] as f, phase("write"), open(outPath, "wb") as out:
+                shutil.copyfileobj(f, out)
+        else:
+            page = md2html(source.decode())
+            with phase("transform"):
+                transform(page)
+            # NOTE: streamed into the file, the whole page never has to be in memory as one string
+            with phase("generate"), open(outPath, "w", encoding="utf-8", newline="") as f:
+                page.write(f)
+            if cached:
+                with phase("cache"):
+                    pages.putFile(key, outPath, pagecache.meta(page))
+        with phase("compress"):
+            compressPage(outPath, encodings)
+    return hashFile(outPath)
+
+
+def buildPool(paths, encodings, jobs, outDir=generatedBlogPath, cached=True):
+    # md2html is all python, so more cores means more processes. yields (path, output hash) in
+    # whatever order the pages finish, every page only depends on its own source so the files
+    # come out the same either way
+    # NOTE: spawn, not fork: forking a process thats running a trio loop is a bad idea
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(jobs, mp_context=ctx) as pool:
+        futs = {pool.submit(buildPage, fpath, encodings, outDir, cached): fpath for fpath in paths}
+        for fut in as_completed(futs):
+            try:
+                yield futs[fut], fut.result()
+            except Exception as e:
+                # dont wait for the rest of the site to tell about the first broken page
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise RuntimeError(f"building {futs[fut]} failed") from e
+
+
 async def getAttrs(fpath):
     # this is jank
     out: dict[str, str] = {}
@@ -44,11 +115,117 @@ async def getAttrs(fpath):
     return out
 
 
-async def trav(origin=blogPath):
+def hashFile(path):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def loadManifest():
+    try:
+        with open(manifestPath) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def saveManifest(manifest):
+    os.makedirs(os.path.dirname(manifestPath), exist_ok=True)
+    with open(manifestPath + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifestPath + ".tmp", manifestPath)
+
+
+def upToDate(entry, want, outPath):
+    # the output has to still be exactly what we wrote last time, someone might have deleted or
+    # edited it since
+    if not entry or any(entry.get(k) != v for k, v in want.items()):
+        return False
+    return os.path.exists(outPath) and hashFile(outPath) == entry.get("output")
+
+
+async def trav(origin=blogPath, encodings=(), force=False, jobs=1):
+    start = time.perf_counter()
+    renderer = pagecache.rendererHash(transform)
+    old, new = loadManifest(), {}
+    todo = {}
+    skipped = 0
+
     for file in sorted(os.listdir(origin)):
-        print(f"generated {file}")
         fpath = os.path.join(origin, file)
-        fpath = await makePost(fpath, force=True)
+        outPath = outputOf(fpath)
+        want = {"source": hashFile(fpath), "renderer": renderer}
+
+        if not force and upToDate(old.get(file), want, outPath):
+            new[file] = old[file]
+            skipped += 1
+            # NOTE: the compressed copies arent in git, so they might be missing even if the html
+            # is fine. making them again doesnt need a render
+            if any(not os.path.exists(outPath + compress.extensions[e]) for e in encodings):
+                compressPage(outPath, encodings)
+            continue
+        todo[fpath] = want
+
+    if jobs > 1 and profiling.current is not None:
+        print("profiling, so building in this process")
+        jobs = 1
+    # NOTE: --force means actually rendering everything again, and so does profiling (a profile of
+    # cache hits doesnt say anything about the renderer)
+    cached = not force and profiling.current is None
+    if jobs > 1 and len(todo) > 1:
+        # NOTE: this blocks the trio loop, but theres nothing else running on it anyway
+        for fpath, output in buildPool(todo, encodings, jobs, cached=cached):
+            print(f"generated {os.path.basename(fpath)}")
+            new[os.path.basename(fpath)] = {**todo[fpath], "output": output}
+    else:
+        for fpath, want in todo.items():
+            print(f"generated {os.path.basename(fpath)}")
+            await makePost(fpath, force=True, encodings=encodings, cached=cached)
+            new[os.path.basename(fpath)] = {**want, "output": hashFile(outputOf(fpath))}
+
+    # the pages of sources that are gone
+    for file in old.keys() - new.keys():
+        outPath = outputOf(os.path.join(origin, file))
+        for path in [outPath, *(outPath + ext for ext in compress.extensions.values())]:
+            if os.path.exists(path):
+                os.remove(path)
+        print(f"removed {os.path.basename(outPath)}")
+
+    saveManifest(new)
+    print(f"{len(todo)} rebuilt, {skipped} skipped in {time.perf_counter() - start:.2f}s")
+
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="also write .gz (and .br/.zst if those libraries are installed) next to the html",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="rebuild every page, even the ones the manifest says are up to date",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="render the pages in this many processes (0 uses every core)",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="time every phase and rule, and write collapsed stacks (for flamegraphs) to FILE",
+    )
+    args = parser.parse_args()
+    if args.profile:
+        profiling.enable(args.profile)
 
-trio.run(trav)
+    trio.run(
+        trav,
+        blogPath,
+        tuple(compress.encoders) if args.compress else (),
+        args.force,
+        args.jobs or os.cpu_count(),
+    )
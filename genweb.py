@@ -1,33 +1,45 @@
+from types import MappingProxyType
+
+# shared by every node that doesnt have any, instead of a new dict/list each time. they are read
+# only, so nobody can add to them by accident
+noAttrs = MappingProxyType({})
+noChildren = ()
+
+
 class Generatable:
+    __slots__ = ()
+
     def generate(self) -> str:
         raise NotImplementedError()
 
 
 class Tag(Generatable):
+    __slots__ = ("name", "attrs", "children")
+
     def __init__(self, name, attrs=None, children: list[Generatable] = None):
         self.name = name
-        self.attrs = attrs or {}
-        self.children = children or []
+        self.attrs = attrs or noAttrs
+        # NOTE: tags get added to after they are made, so they always need their own list
+        self.children = children if children is not None else []
+
+    def opening(self):
+        if not self.attrs:
+            return f"<{self.name}"
+        return f"<{self.name} " + " ".join([f"{a}={b}" for a, b in self.attrs.items()])
 
     def generate(self):
-        attrs = (
-            " " + " ".join([f"{a}={b}" for a, b in self.attrs.items()])
-            if self.attrs
-            else ""
-        )
-        children = "".join([c.generate() for c in self.children])
-        if children:
-            return f"<{self.name}{attrs}>{children}</{self.name}>"
-        return f"<{self.name}{attrs}/>"
+        return "".join(chunks(self))
 
     def __eq__(self, other):
         return self.attrs == other.attrs and self.children == other.children
 
 
 class Content(Generatable):
+    __slots__ = ("cont",)
+    children = noChildren
+
     def __init__(self, cont: str = ""):
         self.cont = cont
-        self.children = []
 
     def generate(self):
         return self.cont
@@ -37,20 +49,74 @@ class Content(Generatable):
 
 
 class Comment(Generatable):
+    __slots__ = ("cont",)
+    children = noChildren
+
     def __init__(self, cont: str):
         self.cont = cont
-        self.children = []
 
     def generate(self) -> str:
         return f"<!--{self.cont}-->"
 
 
 class Joined(Generatable):
+    __slots__ = ("children",)
+
     def __init__(self, cont: list[Generatable]):
         self.children = cont
 
     def generate(self):
-        return "".join([g.generate() for g in self.children])
+        return "".join(chunks(self))
+
+
+def chunks(root: Generatable, size=65536):
+    # the html of ``root``, in pieces of about ``size`` chars. this walks the tree with a stack
+    # instead of recursing, so deep trees dont hit the recursion limit and nothing gets joined
+    # level by level
+    # NOTE: a tag without any output inside it is written as <name/>, so we only open a tag once
+    # something inside it actually writes something. until then it waits in ``unopened``
+    stack = [(None, iter((root,)))]
+    unopened = []
+    out, n = [], 0
+    while stack:
+        tag, children = stack[-1]
+        if (node := next(children, None)) is None:
+            stack.pop()
+            if tag is None:
+                continue
+            if unopened and unopened[-1] is tag:
+                unopened.pop()
+                out += [t.opening() + ">" for t in unopened]
+                unopened.clear()
+                out.append(tag.opening() + "/>")
+            else:
+                out.append(f"</{tag.name}>")
+        # Tag and Joined get walked, anything else is a leaf
+        elif (kind := type(node)) is Tag or (kind is not Content and isinstance(node, Tag)):
+            unopened.append(node)
+            stack.append((node, iter(node.children)))
+            continue
+        elif isinstance(node, Joined):
+            stack.append((None, iter(node.children)))
+            continue
+        elif cont := (node.cont if kind is Content else node.generate()):
+            if unopened:
+                out += [t.opening() + ">" for t in unopened]
+                unopened.clear()
+            out.append(cont)
+        else:
+            continue
+
+        if (n := n + len(out[-1])) >= size:
+            yield "".join(out)
+            out, n = [], 0
+    yield "".join(out)
+
+
+def write(root: Generatable, f, size=65536):
+    # stream the html of ``root`` into the file ``f``
+    for chunk in chunks(root, size):
+        f.write(chunk)
 
 
 create = lambda n: lambda *a, **kwa: Tag(n, *a, **kwa)
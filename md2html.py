@@ -1,22 +1,44 @@
+import bisect
+import hashlib
 import html
+import re
+import threading
+from array import array
+from collections import OrderedDict
 
 import genweb as w
+import profiling
+from profiling import timed
 
 
 class ListIO:
-    def __init__(self, l: list):
+    def __init__(self, l: list, memo: dict | None = None):
         self.l = l
         self.c = 0
+        # (rule, position) -> how that rule matched there, see Rule.match
+        self.memo = memo
+        # set once anything runs into the end of the tokens, see renderBlock. the Untils that ran
+        # off the end get their own list, what they would have done is easy to tell
+        self.edge = False
+        self.runoff: list[Until] = []
 
     def read(self, n: int):
         self.c += n
         return self.l[self.c - n : self.c]
 
+    def next(self):
+        # the kind of the next token, without making a view of it like read does
+        self.c += 1
+        return self.l.kinds[self.c - 1]
+
     def back(self, n: int):
         self.c -= n
 
     def ended(self):
-        return self.c >= len(self.l)
+        if self.c >= len(self.l):
+            self.edge = True
+            return True
+        return False
 
 
 # token strings
@@ -26,28 +48,77 @@ class ListIO:
 # tokens
 
 
-class Token:
-    def __init__(self, name: str):
-        self.name = name
-        self.data = ""
+class Token(int):
+    # a kind of token. it is just an int (so the streams can store it in an array, and comparing
+    # kinds is comparing ints), interned by name - Token("]") is the same kind wherever it is made
+    byName: dict[str, "Token"] = {}
+    byId: list["Token"] = []
 
-    def create(self, data: str):
-        obj = Token(self.name)
-        obj.data = data
-        return obj
+    def __new__(cls, name: str):
+        if (tok := cls.byName.get(name)) is not None:
+            return tok
+        tok = super().__new__(cls, len(cls.byId))
+        tok.name = name
+        cls.byName[name] = tok
+        cls.byId.append(tok)
+        return tok
 
-    def __eq__(self, obj):
-        if not isinstance(obj, Token):
-            raise BaseException(
-                f"comparing token to object of different type ({type(obj)})"
-            )
-        return obj.name == self.name
-
-    def __hash__(self):
-        return hash(self.name)
+    def __repr__(self):
+        return f"<Token {self.name}>"
+
+
+class Tokens:
+    # a stream of tokens, without an object per token: the kinds live in a byte array, and token
+    # ``n`` is ``src[offsets[n]:offsets[n + 1]]``. slicing makes a view (nothing gets copied), and
+    # the text of a slice is a single slice of ``src``
+    def __init__(self, src: str, kinds, offsets):
+        self.src = src
+        self.kinds = memoryview(kinds)
+        self.offsets = memoryview(offsets)  # one longer than kinds
+
+    @classmethod
+    def of(cls, pairs):
+        # a new stream out of (kind, text) pairs
+        kinds, offsets, parts = array("B"), array("I", [0]), []
+        for kind, data in pairs:
+            kinds.append(kind)
+            parts.append(data)
+            offsets.append(offsets[-1] + len(data))
+        return cls("".join(parts), kinds, offsets)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __iter__(self):
+        return iter(self.kinds)
+
+    def __getitem__(self, n):
+        if isinstance(n, slice):
+            start, stop, _ = n.indices(len(self.kinds))
+            stop = max(start, stop)
+            view = Tokens.__new__(Tokens)
+            view.src = self.src
+            view.kinds = self.kinds[start:stop]
+            view.offsets = self.offsets[start : stop + 1]
+            return view
+        return self.kinds[n]
+
+    @classmethod
+    def join(cls, streams):
+        return cls.of(pair for stream in streams for pair in stream.pairs())
+
+    def at(self, n: int):
+        return self.src[self.offsets[n] : self.offsets[n + 1]]
+
+    def pairs(self):
+        return ((Token.byId[k], self.at(n)) for n, k in enumerate(self.kinds))
+
+    @property
+    def data(self):
+        return self.src[self.offsets[0] : self.offsets[-1]]
 
     def __repr__(self):
-        return f"<Token {self.name}, {self.data}>"
+        return f"<Tokens {[(Token.byId[k].name, d) for k, d in self.pairs()]}>"
 
 
 ib = Token("***")
@@ -86,6 +157,9 @@ bqoute = Token(">")
 backslash = Token("\\")
 space = Token(" ")
 
+# a stream that is just a line break, for gluing lines back together
+newline = Tokens.of([(br, "\n")])
+
 # TODO: popup on hover (with some iframe magic)
 # TODO: tables
 # TODO: automatic toc
@@ -100,35 +174,27 @@ space = Token(" ")
 
 # tokenizer
 
-tokens = {}
-
+# every token is a regex, and they all get compiled into one alternation. the alternation tries
+# them in the order they were registered (just like the old scan over ``tokens`` did), so the
+# longer tokens have to be registered before their prefixes (*** before ** before *)
+# NOTE: the patterns cant have capturing groups of their own, use (?:...)
+tokens: dict[Token, str] = {}
+_scanner = None  # compiled on first use, see compileTokens
 
-def token(tok: Token):
-    def deco(fn):
-        tokens[tok] = fn
 
-    return deco
+def token(tok: Token, pattern: str):
+    global _scanner
+    tokens[tok] = pattern
+    _scanner = None
 
 
 def simpleTok(tok: Token, s: str):
-    @token(tok)
-    def check(buf: ListIO):
-        return buf.read(len(s)) == s
+    token(tok, re.escape(s))
 
 
 def quoteTok(tok: Token, q: str):
-    @token(tok)
-    def check(buf: ListIO):
-        if buf.read(len(q)) != q:
-            return False
-
-        o = ""
-        while not o.endswith(q):
-            if buf.ended():
-                return False
-            o += buf.read(1)[0]
-
-        return True
+    # ``q``, then everything up to (and including) the next ``q``
+    token(tok, f"{re.escape(q)}.*?{re.escape(q)}")
 
 
 simpleTok(ib, "***")
@@ -163,39 +229,33 @@ simpleTok(idEnd, "}")
 simpleTok(bqoute, "&gt;")  # >
 simpleTok(vsep, "|")
 simpleTok(space, " ")
+token(backslash, r"\\.?")  # escapes the next char
+token(c, ".")  # has to stay last, matches anything
 
 
-@token(backslash)
-def _bs(buf: ListIO):
-    if buf.read(1) != "\\":
-        return False
-    buf.read(1)
-    return True
-
-
-@token(c)
-def _c(buf: ListIO):
-    buf.read(1)
-    return True
+def compileTokens():
+    # NOTE: the first group is a run of chars where no other token matches, which is what the
+    # ``c`` fallback would have matched one at a time - so it all becomes a single ``c`` token
+    toks = [tok for tok in tokens if tok != c]
+    special = "|".join(tokens[tok] for tok in toks)
+    groups = [f"(?:(?!{special}).)+", *(tokens[tok] for tok in toks), tokens[c]]
+    pattern = re.compile("|".join(f"({g})" for g in groups), re.DOTALL)
+    return pattern, [None, c, *toks, c]
 
 
-def tokenize(cont: str) -> list[Token]:
-    buf = ListIO(cont)
-    toks = []
+@timed("tokenize")
+def tokenize(cont: str) -> Tokens:
+    global _scanner
+    if _scanner is None:
+        _scanner = compileTokens()
+    pattern, byGroup = _scanner
 
-    while not buf.ended():
-        for tok, check in tokens.items():
-            oldc = buf.c
-
-            if check(buf):
-                newc = buf.c
-                # print('read', buf.l[oldc: newc], 'as', tok)
-                toks.append(tok.create(buf.l[oldc:newc]))
-                break
-
-            buf.c = oldc
-
-    return toks
+    kinds, offsets = array("B"), array("I")
+    for m in pattern.finditer(cont):
+        kinds.append(byGroup[m.lastindex])
+        offsets.append(m.start())
+    offsets.append(len(cont))
+    return Tokens(cont, kinds, offsets)
 
 
 # rule parser
@@ -203,6 +263,10 @@ def tokenize(cont: str) -> list[Token]:
 import math
 from typing import Iterable, Optional
 
+# packrat parsing: every parse remembers how each rule matched at each position, so the rules that
+# get retried on the same tokens (mostly Until scanning for a closing token) dont redo the work
+packrat = True
+
 
 class Rule:
     def __init__(self, back=0):
@@ -211,29 +275,48 @@ class Rule:
     def check(self, toks) -> tuple[bool, Iterable]:
         raise NotImplemented()
 
+    def match(self, toks: ListIO) -> tuple[bool, Iterable]:
+        # ``check``, but memoized if this parse has a memo
+        if toks.memo is None:
+            return self.check(toks)
+        key = (self, toks.c)
+        if (hit := toks.memo.get(key)) is None:
+            matches, data = self.check(toks)
+            hit = toks.memo[key] = (matches, toks.c, data)
+        matches, toks.c, data = hit
+        return matches, data
+
 
 class Is(Rule):
     def __init__(self, tok: Token, **kwa):
         super().__init__(**kwa)
         self.tok = tok
 
+    def __repr__(self):
+        return f"Is({self.tok.name!r})"
+
     def check(self, toks: ListIO):
-        if (tok := toks.read(1)[0]) == self.tok:
-            return True, [tok]
+        if toks.next() == self.tok:
+            return True, [toks.l[toks.c - 1 : toks.c]]
         return False, None
 
+    match = check  # cheaper than the memo lookup
+
 
 class All(Rule):
     def __init__(self, *rules: list[Rule], **kwa):
         super().__init__(**kwa)
         self.rules = rules
 
+    def __repr__(self):
+        return f"All({', '.join(map(repr, self.rules))})"
+
     def check(self, toks: ListIO):
         datas = []
         for rule in self.rules:
             if toks.ended():
                 return False, None
-            matches, data = rule.check(toks)
+            matches, data = rule.match(toks)
             if not matches:
                 return False, None
 
@@ -249,19 +332,60 @@ class Until(Rule):
         self.no = no
         self.only = only
 
+    def __repr__(self):
+        return f"Until({self.tok.name!r})"
+
     def check(self, toks: ListIO):
-        data = []
-        while (tok := toks.read(1)[0]) != self.tok:
+        start = toks.c
+        while True:
+            # check if the buffer ran out
+            if toks.c >= len(toks.l):
+                toks.runoff.append(self)
+                return False, None
+            if (tok := toks.next()) == self.tok:
+                break
             # check if token is not allowed, because of blacklist
             # check if we have a whitelist, and if the token is not allowed because of it
-            # check if the buffer ran out
-            if tok in self.no or (self.only and tok not in self.only) or toks.ended():
+            if tok in self.no or (self.only and tok not in self.only):
                 return False, None
-            data.append(tok)
 
         # here we also return the token that ended the rule (just to match the behaviour of the rest
         # of the rules)
-        return True, (data, tok)
+        return True, (toks.l[start : toks.c - 1], tok)
+
+    def match(self, toks: ListIO):
+        if toks.memo is None:
+            return self.check(toks)
+
+        # every position we walk past ends up at the same closing token (or the same failure), so
+        # they all get memoized - an unclosed ``*`` makes every later Until(i) a single lookup
+        # instead of another scan to the end
+        # NOTE: there are a lot of these, so they get an array per rule instead of memo entries.
+        # 0 is not known yet, end + 1 is a match ending at end, -end - 1 is a failure at end
+        if (ends := toks.memo.get(self)) is None:
+            ends = toks.memo[self] = array("i", bytes(4 * (len(toks.l) + 1)))
+        kinds = toks.l.kinds
+        start = p = toks.c
+        while not (hit := ends[p]):
+            if p >= len(kinds):
+                toks.runoff.append(self)
+                hit = -p - 1
+                break
+            tok = kinds[p]
+            p += 1
+            if tok == self.tok:
+                hit = p + 1
+            elif tok in self.no or (self.only and tok not in self.only):
+                hit = -p - 1
+            else:
+                continue
+            break
+        ends[start:p] = array("i", [hit]) * (p - start)
+
+        toks.c = abs(hit) - 1
+        if hit < 0:
+            return False, None
+        return True, (toks.l[start : toks.c - 1], self.tok)
 
 
 class Repeating(Rule):
@@ -269,11 +393,14 @@ class Repeating(Rule):
         super().__init__(**kwa)
         self.rule = rule
 
+    def __repr__(self):
+        return f"Repeating({self.rule!r})"
+
     def check(self, toks: ListIO):
         datas = []
         while True:
             oldc = toks.c
-            matching, data = self.rule.check(toks)
+            matching, data = self.rule.match(toks)
             if not matching:
                 toks.c = oldc
                 if datas:
@@ -287,13 +414,16 @@ class Shortest(Rule):
         self.rules = rules
         super().__init__(**kwa)
 
+    def __repr__(self):
+        return f"Shortest({', '.join(map(repr, self.rules))})"
+
     def check(self, toks: ListIO) -> tuple[bool, Iterable]:
         out = None
         minc = math.inf
         startc = toks.c
 
         for r in self.rules:
-            matches, data = r.check(toks)
+            matches, data = r.match(toks)
             if matches and toks.c < minc:
                 out = data
                 minc = toks.c
@@ -312,10 +442,13 @@ class First(Rule):
         super().__init__(**kwa)
         self.rules = rules
 
+    def __repr__(self):
+        return f"First({', '.join(map(repr, self.rules))})"
+
     def check(self, toks: ListIO) -> tuple[bool, Iterable]:
         for r in self.rules:
             start = toks.c
-            matches, data = r.check(toks)
+            matches, data = r.match(toks)
             if matches:
                 return True, data
             toks.c = start
@@ -326,19 +459,31 @@ class Pass(Rule):
     def __init__(self, **kwa):
         super().__init__(**kwa)
 
+    def __repr__(self):
+        return "Pass()"
+
     def check(self, toks: ListIO):
         return True, None
 
+    match = check
+
 
 Optional = lambda rule: First(rule, Pass())
 
 
 rules = {}
+_index = None  # built on first use, see buildIndex
+
+
+def addRule(r: Rule, fn):
+    global _index
+    rules[r] = fn
+    _index = None
 
 
 def rule(r: Rule):
     def deco(fn):
-        rules[r] = fn
+        addRule(r, fn)
 
     return deco
 
@@ -349,7 +494,9 @@ def srule(tok, tag, parse=True, back=0):
         cont, _ = data
         return tag(page, buildTree(cont, page).children if parse else cont)
 
-    rules[All(Is(tok), Until(tok), back=back)] = _parse
+    # NOTE: so the rules made here can be told apart in profiles
+    _parse.__name__ = f"srule[{tok.name!r}]"
+    addRule(All(Is(tok), Until(tok), back=back), _parse)
 
 
 def drule(tok, tag):
@@ -358,7 +505,8 @@ def drule(tok, tag):
         # TODO: move this to ``tag({}, [tok])`` or something along those lines
         return tag(page, tok.data)
 
-    rules[Is(tok)] = parse
+    parse.__name__ = f"drule[{tok.name!r}]"
+    addRule(Is(tok), parse)
 
 
 def lrule(tok, tag, title=True, level=-1):
@@ -379,30 +527,95 @@ def lrule(tok, tag, title=True, level=-1):
             ]
         return tag(page, children, _id)
 
-    rules[
+    parse.__name__ = f"lrule[{tok.name!r}]"
+    addRule(
         All(
             Is(br),
             Is(tok),
             First(All(Until(idStart, no=[br]), Until(idEnd), Is(br)), Until(br)),
             back=1,
-        )
-    ] = parse
+        ),
+        parse,
+    )
 
 
+# first-token dispatch: most rules can only match on one kind of token (Is(br), Is(img), ...), so
+# buildTree only tries the ones that can start with the token it is looking at
+dispatch = True
+# set this to a collections.Counter to count how many times buildTree tries each rule
+attempts = None
+
+
+def firsts(r: Rule):
+    # the tokens ``r`` can start with, None if it might start with anything
+    if isinstance(r, Is):
+        return {r.tok}
+    if isinstance(r, All):
+        return firsts(r.rules[0])
+    if isinstance(r, Repeating):
+        return firsts(r.rule)
+    if isinstance(r, (First, Shortest)):
+        out = set()
+        for sub in r.rules:
+            if (f := firsts(sub)) is None:
+                return None
+            out |= f
+        return out
+    return None  # Until, Pass, and anything we dont know about
+
+
+def buildIndex():
+    # token -> the rules that might match there, in the same order as ``rules``. the catch-all
+    # rules are in every list, and are the only candidates for tokens no rule starts with
+    keyed = [(r, fn, firsts(r)) for r, fn in rules.items()]
+    catchAll = [(r, fn) for r, fn, f in keyed if f is None]
+    index = {}
+    for _, _, f in keyed:
+        for tok in f or ():
+            index[tok] = [(r, fn) for r, fn, f in keyed if f is None or tok in f]
+    return index, catchAll
+
+
+@timed("buildTree")
 def buildTree(toks, page):
-    buf = ListIO(toks)
+    return _buildTree(ListIO(toks, {} if packrat else None), page, len(toks))
+
+
+def _buildTree(buf: ListIO, page, stop: int):
+    # the tree of the tokens in ``buf`` up to ``stop`` (rules can still look past it)
+    global _index
+    if _index is None:
+        _index = buildIndex()
+    index, catchAll = _index
+    prof = profiling.current
+
     body = w.body()
+    # text waiting to go into the body - runs of Content get merged into one
+    text = []
 
-    while not buf.ended():
+    while buf.c < stop:
         matches = False
-        for rule, fn in rules.items():
+        candidates = index.get(buf.l[buf.c], catchAll) if dispatch else rules.items()
+        for rule, fn in candidates:
+            if attempts is not None:
+                attempts[rule] += 1
             oldc = buf.c
-            matches, datas = rule.check(buf)
+            # NOTE: no memo at this level, we never come back to a position with the same rule
+            if prof is None:
+                matches, datas = rule.check(buf)
+            else:
+                matches, datas = prof.attempt(rule, fn, buf)
             if matches:
-                out = fn(page, *datas)
+                out = fn(page, *datas) if prof is None else prof.handle(fn, page, datas)
                 if out:
                     # print(f'matched "{buf.l[oldc:buf.c]}" to {fn} with {datas}')
-                    body.children.append(out)
+                    if type(out) is w.Content:
+                        text.append(out.cont)
+                    else:
+                        if cont := "".join(text):
+                            body.children.append(w.Content(cont))
+                        text.clear()
+                        body.children.append(out)
                     buf.back(rule.back)
                     break
             buf.c = oldc
@@ -410,19 +623,19 @@ def buildTree(toks, page):
         # print(f'c is {buf.c}, tok is {buf.l[buf.c]}')
 
         if not matches:
-            body.children.append(w.Content(buf.read(1)[0].data))
+            text.append(buf.l.at(buf.c))
+            buf.c += 1
             # i think this is how you should handle unmatched stuff?
 
         # print(body.generate())
 
+    if cont := "".join(text):
+        body.children.append(w.Content(cont))
     return body
 
 
-def tostr(toks):
-    o = ""
-    for tok in toks:
-        o += tok.data
-    return o
+def tostr(toks: Tokens):
+    return toks.data
 
 
 # a little page class!
@@ -439,6 +652,10 @@ class Page:
     def generate(self):
         return w.Joined([self.head, self.body]).generate()
 
+    def write(self, f):
+        # like generate, but streamed into the file ``f``
+        w.write(w.Joined([self.head, self.body]), f)
+
 
 # rules
 
@@ -591,7 +808,7 @@ def _img(page, _1, cont):
 def scissors(page, _1, cont, _2):
     fish, _n, (cont, _fish) = cont
     inside = buildTree(cont, page)
-    fish = fish[0]
+    fish = fish[0][0]  # the kind of the (only) token Is matched
     return w.div(
         {
             "style": f'"width:44%;float:{"left" if fish == fishl else "right"};margin: 3%;"'
@@ -628,13 +845,14 @@ def _exp(page, _1, d1, d2):
     return w.abbr({"title": f'"{tostr(d2)}"', "tabindex": '"-1"'}, d1c)
 
 
+# NOTE: the handlers are told apart by name in profiles, so these three cant all be _br
 @rule(All(Is(br), Is(br), back=1))
-def _br(page, _1, _2):
+def _emptyLine(page, _1, _2):
     return w.br()
 
 
 @rule(Is(backslash))
-def _br(page, data):
+def _escape(page, data):
     # TODO: should this work token-wise sometimes?
     return w.Content(data.data[-1])
 
@@ -702,7 +920,7 @@ def vertical(page, _, data):
             l  # left might be more than one seperated parts, but right is always single
         )
         for i, part in enumerate([*[lef[0] for lef in left], right[0]]):
-            parts[i] = [*parts.get(i, []), part, [br.create("\n")]]
+            parts[i] = [*parts.get(i, []), part, newline]
 
     fbox = w.div(
         {"style": '"justify-content:space-between;flex-wrap:wrap;display:flex"'}, []
@@ -710,10 +928,7 @@ def vertical(page, _, data):
     # TODO: same todo as the one below
 
     for part in parts.values():
-        flat = []
-        for l in part:
-            flat += l
-        body = buildTree(flat, page)
+        body = buildTree(Tokens.join(part), page)
         # ... this style is so shit
         # TODO: why not just export this style elsewhere lol
         fbox.children.append(
@@ -742,11 +957,10 @@ lrule(attr, _attr, title=False)
 def _bquote(page, _, a):
     c = []
     for l in a:
-        c += l[1][0]
-        c += [br.create("\n")]
+        c += [l[1][0], newline]
         # this is a little hack to keep new lines
 
-    return w.bqoute({}, buildTree(c, page).children)
+    return w.bqoute({}, buildTree(Tokens.join(c), page).children)
 
 
 @rule(Is(br))
@@ -755,13 +969,133 @@ def _br(page, _1):
     # dont include br in the left-over tokens - this renders as a space in web browsers :/
 
 
+# incremental rendering: the document gets split into blocks at empty lines, and the html of every
+# block is kept (by the hash of its tokens), so after an edit only the blocks that changed get
+# parsed again. the output is the same as buildTree over the whole thing, down to the byte
+# NOTE: off by default, its only worth it for a process rendering the same pages over and over
+# (like the server rebuilding a post on every save)
+incremental = False
+# hash of a block -> (html, titles, attrs, the Untils that ran off its end), or None for a block
+# that cant be parsed on its own
+blockCache: "OrderedDict[bytes, tuple | None]" = OrderedDict()
+blockLock = threading.Lock()  # the server renders in threads
+maxBlocks = 4096
+
+
+def blockEnds(kinds: bytes):
+    # where blocks can end: the second br of every empty line. a block stops right before it, and
+    # the next one starts with it (rules like lrule and hr need the br before their line)
+    pair = bytes([br, br])
+    out = []
+    n = kinds.find(pair)
+    while n != -1:
+        out.append(n + 1)
+        n = kinds.find(pair, n + 1)
+    return out
+
+
+def reach(kinds: bytes, p: int, runoff):
+    # how far the Untils that ran off the end of a block would have gone if they kept going at
+    # ``p``: the furthest token one of them would have matched, or -1 if they would all fail in the
+    # whole document just like they did in the block
+    far = -1
+    for rule in runoff:
+        if rule.only:
+            return len(kinds) - 1  # NOTE: not used by any rule, so not worth checking
+        hit = kinds.find(bytes([rule.tok]), p)
+        if hit != -1 and all(kinds.find(bytes([tok]), p, hit) == -1 for tok in rule.no):
+            far = max(far, hit)
+    return far
+
+
+def renderBlock(toks: Tokens, kinds: bytes, start: int, end: int):
+    # (html, titles, attrs, runoff) of toks[start:end], if it parses the same on its own
+    # the block gets parsed with the br at ``end`` still there (the rules ending a line want to see
+    # it), anything that runs past that br, or stops somewhere else than ``end``, might depend on
+    # what comes after - then the caller has to try again with a bigger block. thats None, or the
+    # token the bigger block has to get to at least
+    # NOTE: an Until that ran off the end only matters if it would have found its token further
+    # along, which ``kinds`` (of the whole document) tells without parsing anything
+    final = end == len(toks)
+    view = toks[start : end if final else end + 1]
+    base = view.offsets[0]
+    h = hashlib.blake2b(bytes(view.kinds), digest_size=16)
+    h.update(array("I", [o - base for o in view.offsets]).tobytes())
+    h.update(view.data.encode())
+    h.update(b"$" if final else b"")
+    key = h.digest()
+    with blockLock:
+        if key in blockCache:
+            blockCache.move_to_end(key)
+            out = blockCache[key]
+            if out is None or (far := reach(kinds, end + 1, out[3])) == -1:
+                return out
+            return far
+
+    page = Page()
+    buf = ListIO(view, {} if packrat else None)
+    try:
+        body = _buildTree(buf, page, end - start)
+    except Exception:
+        # once it has seen the edge it might be on a path the whole document never takes
+        if final or not buf.edge and reach(kinds, end + 1, buf.runoff) == -1:
+            raise
+        return None
+    if final or (buf.c == end - start and not buf.edge):
+        runoff = () if final else tuple(set(buf.runoff))
+        out = (w.Joined(body.children).generate(), page.titles, page.attrs, runoff)
+    else:
+        out = None
+    with blockLock:
+        blockCache[key] = out
+        if len(blockCache) > maxBlocks:
+            blockCache.popitem(last=False)
+    if out is None or (far := reach(kinds, end + 1, out[3])) == -1:
+        return out
+    return far
+
+
+@timed("buildBlocks")
+def buildBlocks(toks: Tokens, page):
+    # buildTree, a block at a time (see incremental)
+    kinds = bytes(toks.kinds)
+    ends = [*blockEnds(kinds), len(toks)]
+    if len(ends) == 1:
+        return buildTree(toks, page)  # a single block, theres nothing to reuse
+    body = w.body()
+    start, k = 0, 0
+    while start < len(toks):
+        while ends[k] <= start:
+            k += 1
+        # a block that doesnt work on its own gets merged with the blocks after it: up to where the
+        # Until that ran off would have ended, or else the next 1, 3, 7, ... blocks. the last try is
+        # the whole rest of the document
+        n = 0
+        while True:
+            end = ends[min(k + n, len(ends) - 1)]
+            if type(out := renderBlock(toks, kinds, start, end)) is tuple:
+                break
+            n = n * 2 + 1 if out is None else max(n + 1, bisect.bisect_left(ends, out) - k)
+        html, titles, attrs, _ = out
+        if html:
+            body.children.append(w.Content(html))
+        page.titles.extend(titles)
+        for field, val in attrs.items():
+            page.attrs[field] = val
+        start = end
+    return body
+
+
 def _md2html(cont, page):
     toks = tokenize(
         "\n" + cont + "\n"
     )  # a little hack to get #, ##, ---, etc. working if they are at the top/bottom of the document
-    return buildTree(toks, page)
+    if profiling.current is not None:
+        profiling.current.count("tokens", len(toks))
+    return buildBlocks(toks, page) if incremental else buildTree(toks, page)
 
 
+@timed("postproc")
 def postproc(cont):
     return html.escape(cont)
 
@@ -790,6 +1124,7 @@ def preview(cont):
     return page
 
 
+@timed("toc")
 def toc(page: Page):
     root = w.ul()
     cur = root
@@ -810,6 +1145,7 @@ def toc(page: Page):
     return root
 
 
+@timed("md2html")
 def md2html(cont):
     page = Page()
     cont = postproc(cont)
@@ -851,4 +1187,6 @@ def md2html(cont):
     if int(page.attrs.get("toc", "0")):
         page.body = w.Joined([toc(page), page.body])
 
+    if profiling.current is not None:
+        profiling.current.count("nodes", profiling.nodes(page.body))
     return page
@@ -0,0 +1,151 @@
+import sys
+
+import trio
+
+# latencies are recorded in microseconds, into log-linear buckets (like HdrHistogram): every
+# power of two is split into 2 ** subBits buckets, so the error is bounded at ~6% everywhere
+subBits = 4
+sub = 1 << subBits
+maxValue = 1 << 36  # ~19 hours, anything slower is clamped
+
+
+def bucket(v: int):
+    if v < sub:
+        return v
+    shift = v.bit_length() - subBits - 1
+    return sub + shift * sub + (v >> shift) - sub
+
+
+def upper(i: int):
+    # the (exclusive) upper bound of bucket ``i``
+    if i < sub:
+        return i + 1
+    shift, top = divmod(i - sub, sub)
+    return (sub + top + 1) << shift
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (bucket(maxValue) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bucket(min(int(seconds * 1e6), maxValue))] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, p: float):
+        # in seconds
+        if not self.count:
+            return 0.0
+        target = p * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return upper(i) / 1e6
+        return maxValue / 1e6
+
+    def below(self, us: int):
+        # how many values were smaller than ``us`` microseconds
+        return sum(self.counts[: bucket(us)])
+
+
+class RouteStats:
+    def __init__(self):
+        self.statuses: dict[int, int] = {}
+        self.bytes = 0
+        self.latency = Histogram()
+
+
+# prometheus histogram buckets, powers of two from 16us to ~16s
+exported = [1 << k for k in range(4, 25)]
+quantiles = [0.5, 0.9, 0.99, 0.999]
+
+
+def label(s: str):
+    return s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    def __init__(self):
+        self.routes: dict[str, RouteStats] = {}
+
+    def record(self, route: str, status: int, sent: int, seconds: float):
+        if (stats := self.routes.get(route)) is None:
+            stats = self.routes[route] = RouteStats()
+        stats.statuses[status] = stats.statuses.get(status, 0) + 1
+        stats.bytes += sent
+        stats.latency.record(seconds)
+
+    def render(self, gauges: dict[str, float] = {}):
+        # prometheus text format
+        out = ['# TYPE srv_requests_total counter']
+        for route, stats in self.routes.items():
+            for status, n in stats.statuses.items():
+                out.append(f'srv_requests_total{{route="{label(route)}",status="{status}"}} {n}')
+
+        out.append('# TYPE srv_response_bytes_total counter')
+        for route, stats in self.routes.items():
+            out.append(f'srv_response_bytes_total{{route="{label(route)}"}} {stats.bytes}')
+
+        out.append('# TYPE srv_request_duration_seconds histogram')
+        for route, stats in self.routes.items():
+            h = stats.latency
+            name = f'srv_request_duration_seconds_bucket{{route="{label(route)}"'
+            for us in exported:
+                out.append(f'{name},le="{us / 1e6:g}"}} {h.below(us)}')
+            out.append(f'{name},le="+Inf"}} {h.count}')
+            out.append(f'srv_request_duration_seconds_sum{{route="{label(route)}"}} {h.sum}')
+            out.append(f'srv_request_duration_seconds_count{{route="{label(route)}"}} {h.count}')
+
+        out.append('# TYPE srv_request_duration_quantile_seconds gauge')
+        for route, stats in self.routes.items():
+            for q in quantiles:
+                out.append(
+                    f'srv_request_duration_quantile_seconds{{route="{label(route)}",quantile="{q}"}}'
+                    f' {stats.latency.percentile(q):g}'
+                )
+
+        typed = set()
+        for name, val in gauges.items():
+            if (base := name.partition('{')[0]) not in typed:
+                typed.add(base)
+                out.append(f'# TYPE {base} gauge')
+            out.append(f'{name} {val}')
+
+        return '\n'.join(out) + '\n'
+
+
+class AccessLog:
+    # lines get queued without blocking, and a background task writes them out in batches from a
+    # worker thread, so a slow terminal/disk never stalls the event loop
+    def __init__(self, out=sys.stdout, maxPending=10000):
+        self.out = out
+        self._send, self._recv = trio.open_memory_channel(maxPending)
+        self.dropped = 0
+
+    def log(self, line: str):
+        try:
+            self._send.send_nowait(line)
+        except trio.WouldBlock:
+            self.dropped += 1  # better to lose log lines than to stall requests
+
+    def write(self, lines: list[str]):
+        self.out.write(''.join(l + '\n' for l in lines))
+        self.out.flush()
+
+    async def run(self):
+        async for line in self._recv:
+            batch = [line]
+            while True:
+                try:
+                    batch.append(self._recv.receive_nowait())
+                except (trio.WouldBlock, trio.EndOfChannel):
+                    break
+            await trio.to_thread.run_sync(self.write, batch)
+
+    async def aclose(self):
+        # run drains whatever is left and returns
+        await self._send.aclose()
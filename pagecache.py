@@ -0,0 +1,138 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+
+import genweb
+import md2html
+
+root = os.path.dirname(os.path.abspath(__file__))
+cacheDir = os.path.join(root, ".build", "pages")
+
+
+@functools.cache
+def rendererHash(*fns):
+    # a change to the renderer (or the functions wrapped around it, like transform) can change
+    # every single page
+    # NOTE: once per process, a server should keep using the hash of the code it has loaded
+    h = hashlib.sha256()
+    for mod in (md2html, genweb):
+        with open(mod.__file__, "rb") as f:
+            h.update(f.read())
+    for fn in fns:
+        h.update(inspect.getsource(fn).encode())
+    return h.hexdigest()
+
+
+class PageCache:
+    # rendered html (and the attrs and titles of the Page) on disk, keyed by the hash of the
+    # source and the renderer. the least recently used pages go once it gets over ``budget`` bytes
+    # NOTE: genall and the server can both be writing here at once. every entry is written to a
+    # temp file and renamed into place, so readers see the whole old one or the whole new one,
+    # and a file that got evicted under a reader is just a miss
+    def __init__(self, path=cacheDir, budget=64 * 1024 * 1024):
+        self.path = path
+        self.budget = budget
+        # NOTE: only an estimate (other processes write here too), the real size gets counted
+        # again when this goes over the budget
+        self.used: int | None = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, source: bytes, renderer: str):
+        return hashlib.sha256(renderer.encode() + b"\0" + source).hexdigest()
+
+    def file(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def reader(self, key):
+        # (file, meta) or None, the file is at the start of the html
+        # NOTE: an open file stays readable even if it gets evicted or replaced in the meantime
+        try:
+            f = open(self.file(key), "rb")
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        try:
+            meta = json.loads(f.readline())
+            os.utime(self.file(key))  # the mtime is when it was last used
+        except (FileNotFoundError, ValueError):
+            f.close()
+            self.misses += 1
+            return None
+        self.hits += 1
+        return f, meta
+
+    def get(self, key):
+        # (html, meta) or None
+        if (hit := self.reader(key)) is None:
+            return None
+        f, meta = hit
+        with f:
+            return f.read(), meta
+
+    def put(self, key, cont: bytes, meta: dict = {}):
+        self.store(key, meta, lambda f: f.write(cont))
+
+    def putFile(self, key, path, meta: dict = {}):
+        # put, with the html copied over from the file at ``path`` instead of held in memory
+        with open(path, "rb") as src:
+            self.store(key, meta, lambda f: shutil.copyfileobj(src, f))
+
+    def store(self, key, meta, fill):
+        path = self.file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(json.dumps(meta, ensure_ascii=False).encode() + b"\n")
+                fill(f)
+                size = f.tell()
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        if self.used is None:
+            self.used = sum(size for _, size, _ in self.entries())
+        else:
+            self.used += size
+        if self.used > self.budget:
+            self.evict()
+
+    def entries(self):
+        out = []
+        for d in os.listdir(self.path) if os.path.isdir(self.path) else ():
+            for file in os.listdir(os.path.join(self.path, d)):
+                if file.startswith(".tmp-"):
+                    continue
+                try:
+                    st = os.stat(path := os.path.join(self.path, d, file))
+                except FileNotFoundError:
+                    continue
+                out.append((st.st_mtime, st.st_size, path))
+        return out
+
+    def evict(self):
+        entries = sorted(self.entries())
+        used = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if used <= self.budget:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass  # somebody else evicted it first
+            used -= size
+        self.used = used
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+def meta(page: md2html.Page):
+    return {"attrs": page.attrs, "titles": page.titles}
@@ -1,11 +1,15 @@
 import os
+import traceback
 
 import inotify.adapters
 import trio
 
 import genweb as w
-from conf import initer
+import md2html as renderer
+import pagecache
+from conf import runThread, server, singleIniter
 from md2html import Page, md2html
+from profiling import phase, timed
 
 parent = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
 blogPath = os.path.join(parent, "content")
@@ -13,6 +17,20 @@ generatedBlogPath = os.path.join(parent, "static")
 
 
 handle = {"IN_CREATE", "IN_DELETE", "IN_MOVED_FROM", "IN_MOVED_TO", "IN_CLOSE_WRITE"}
+# how long a file has to stay quiet before it gets rebuilt. editors tend to save in a few steps
+# (temp file, rename, chmod, ...) and every one of them is an event
+rebuildWindow = 0.25
+# the rendered pages go straight into the server's routes (gzipped etc. if compressPages), writing
+# them to static/ too is only for the Pages deploy and for the other --workers, which only see
+# what's on disk
+publishPages = True
+compressPages = True
+writeToDisk = True
+# rendered pages by the hash of their source, so a restart doesnt have to render everything again
+pages = pagecache.PageCache()
+# a post gets rendered again on every save while its being written, so keep the html of its
+# blocks around and only parse the ones that changed
+renderer.incremental = True
 
 
 def transform(p: Page):
@@ -23,16 +41,159 @@ def transform(p: Page):
     ]
 
 
+@timed("write")
+def writeBytes(cont: bytes, path):
+    with open(path, "wb") as f:
+        f.write(cont)
+
+
+def outputOf(path):
+    return os.path.join(generatedBlogPath, os.path.basename(path))[:-3] + ".html"
+
+
+def urlOf(path):
+    # where the static/ watcher would have served the html
+    return outputOf(path)[len(generatedBlogPath) :]
+
+
+@timed("generate")
+def generatePage(p: Page):
+    return p.generate().encode()
+
+
+def renderPage(path):
+    # the html for the markdown in ``path``, from the cache if it has been rendered before
+    with phase(f"page:{os.path.basename(path)}"):
+        with phase("read"), open(path, "rb") as f:
+            source = f.read()
+        key = pages.key(source, pagecache.rendererHash(transform))
+        if (hit := pages.get(key)) is not None:
+            return hit[0]
+        out = md2html(source.decode())
+        with phase("transform"):
+            transform(out)
+        cont = generatePage(out)
+        pages.put(key, cont, pagecache.meta(out))
+    return cont
+
+
+async def publishPage(cont: bytes, path, write=True):
+    outPath = outputOf(path)
+    if publishPages:
+        await server.publish(cont, urlOf(path), compressed=compressPages)
+    if write and writeToDisk:
+        await trio.to_thread.run_sync(writeBytes, cont, outPath)
+    return outPath
+
+
+def unpublishPage(path):
+    outPath = outputOf(path)
+    if urlOf(path) in server.published:
+        server.unserve(urlOf(path))
+    if writeToDisk and os.path.exists(outPath):
+        os.remove(outPath)
+
+
+def differs(cont: bytes, path):
+    # whether the file at ``path`` isnt exactly ``cont`` already
+    try:
+        with open(path, "rb") as f:
+            return f.read() != cont
+    except FileNotFoundError:
+        return True
+
+
 async def makePost(path, force=False):
-    outPath = os.path.join(generatedBlogPath, os.path.basename(path))[:-3] + ".html"
-    async with await trio.open_file(path, "r") as f:
-        out = md2html(await f.read())
-        transform(out)
-    if not force and os.path.exists(outPath):
+    outPath = outputOf(path)
+    if not publishPages and not force and os.path.exists(outPath):
         return outPath
-    async with await trio.open_file(outPath, "w+") as f:
-        await f.write(out.generate())
-    return outPath
+    cont = await trio.to_thread.run_sync(renderPage, path)
+    # NOTE: the other --workers serve whats on disk, so a stale file there has to go even if we
+    # publish from memory
+    write = force or await trio.to_thread.run_sync(differs, cont, outPath)
+    return await publishPage(cont, path, write=write)
+
+
+class RebuildQueue:
+    # collects the changed sources and rebuilds each one once it has been quiet for ``window``
+    # seconds. what happens only depends on the file at that point: if its there it gets
+    # rendered, if its gone so is its html
+    def __init__(self, window=rebuildWindow):
+        self.window = window
+        self.pending: dict[str, float] = {}  # source -> when to rebuild it
+        self.running: dict[str, trio.CancelScope] = {}
+        self.wake = trio.Event()
+        # NOTE: one write at a time, so a superseded render that got as far as writing cant end up
+        # on disk after the one that replaced it
+        self.writing = trio.Lock()
+        self.queued = self.coalesced = self.completed = self.superseded = self.failed = 0
+
+    def push(self, src):
+        if src in self.pending:
+            self.coalesced += 1
+        else:
+            self.queued += 1
+        self.pending[src] = trio.current_time() + self.window
+        # whatever is being rendered for it is out of date already
+        if (scope := self.running.get(src)) is not None:
+            scope.cancel()
+        self.wake.set()
+
+    def stats(self):
+        return {
+            "queued": self.queued,
+            "coalesced": self.coalesced,
+            "completed": self.completed,
+            "superseded": self.superseded,
+            "failed": self.failed,
+            "pending": len(self.pending),
+            "running": len(self.running),
+        }
+
+    async def run(self):
+        async with trio.open_nursery() as nurs:
+            while True:
+                await self.wake.wait()
+                self.wake = trio.Event()
+                # NOTE: a push never moves the earliest deadline forward, so sleeping until it is
+                # always safe
+                while self.pending:
+                    await trio.sleep_until(min(self.pending.values()))
+                    now = trio.current_time()
+                    for src in [s for s, due in self.pending.items() if due <= now]:
+                        del self.pending[src]
+                        nurs.start_soon(self.rebuild, src)
+
+    async def rebuild(self, src):
+        with trio.CancelScope() as scope:
+            self.running[src] = scope
+            try:
+                await self.build(src)
+                self.completed += 1
+            except Exception:
+                traceback.print_exc()
+                self.failed += 1
+            finally:
+                if self.running.get(src) is scope:
+                    del self.running[src]
+        if scope.cancelled_caught:
+            self.superseded += 1
+
+    async def build(self, src):
+        if not os.path.exists(src):
+            async with self.writing:
+                unpublishPage(src)
+            print(f"removed {urlOf(src)}")
+            return
+        # NOTE: a thread cant be stopped, cancelling just leaves it to finish and throws the page
+        # away. the html is only published if nothing newer came in while rendering
+        cont = await runThread(renderPage, src)
+        async with self.writing:
+            await publishPage(cont, src)
+        print(f"rebuilt {urlOf(src)}")
+
+
+rebuilds = RebuildQueue()
 
 
 def inotifyLoop():
@@ -44,16 +205,11 @@ def inotifyLoop():
         (_, types, path, filename) = event
 
         # print(f"PATH=[{path}] FILENAME=[{filename}] EVENT_TYPES={types}")
-        for etype in types:
-            if etype in handle:
-                place = os.path.join(path, filename)
-                path = place[len(parent) :]
-                if etype not in {"IN_DELETE", "IN_MOVED_TO"}:
-
-                    async def wrapper():
-                        return await makePost(place, force=True)
-
-                    trio.from_thread.run(wrapper)
+        # NOTE: editors leave swap and backup files around, those arent pages
+        if not filename.endswith(".md") or filename.startswith("."):
+            continue
+        if handle.intersection(types):
+            trio.from_thread.run_sync(rebuilds.push, os.path.join(path, filename))
 
 
 async def getAttrs(fpath):
@@ -70,10 +226,12 @@ async def getAttrs(fpath):
     return out
 
 
-@initer
+@singleIniter
 async def trav(origin=blogPath):
     for file in sorted(os.listdir(origin)):
         fpath = os.path.join(origin, file)
         fpath = await makePost(fpath)
 
-    await trio.to_thread.run_sync(inotifyLoop)
+    async with trio.open_nursery() as nurs:
+        nurs.start_soon(rebuilds.run)
+        await runThread(inotifyLoop)
@@ -0,0 +1,46 @@
+import ipaddress
+import os
+
+import trio
+
+from conf import server
+from paths import blog
+from srv import Request
+
+
+def local(r: Request):
+    if not isinstance(r.stream, trio.SocketStream):
+        return False
+    try:
+        return ipaddress.ip_address(r.stream.socket.getpeername()[0]).is_loopback
+    except ValueError:
+        return False
+
+
+# NOTE: with --workers every process keeps its own numbers, the pid label tells them apart
+@server.handler("/_metrics")
+async def metrics(r: Request):
+    # only for a scraper running on the same machine
+    if not local(r):
+        return await server.fail(r)
+
+    cache = server.cache.stats()
+    gauges = {
+        f'srv_info{{pid="{os.getpid()}"}}': 1,
+        "srv_connections_active": server.limiter.borrowed_tokens,
+        "srv_connections_idle": len(server.waiting),
+        "srv_access_log_dropped": server.accessLog.dropped if server.accessLog else 0,
+    }
+    for key, val in cache.items():
+        gauges[f"srv_cache_{key}"] = val
+    # NOTE: only the worker running the singleIniters rebuilds anything
+    for key, val in blog.rebuilds.stats().items():
+        gauges[f"blog_rebuilds_{key}"] = val
+    for key, val in blog.pages.stats().items():
+        gauges[f"blog_pagecache_{key}"] = val
+
+    await r.send(
+        200,
+        {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        server.metrics.render(gauges).encode(),
+    )
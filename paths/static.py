@@ -3,7 +3,7 @@ import os
 import inotify.adapters
 import trio
 
-from conf import initer, server, start_soon
+from conf import initer, runThread, server, start_soon
 
 parent = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
 srvDir = os.path.join(parent, "static")
@@ -29,6 +29,8 @@ def inotifyLoop(dir):
             }:
                 place = os.path.join(path, filename)
                 path = place[len(srvDir) :]
+                if path in server.published:
+                    continue
                 if server.serving(path):
                     print(f"unserving {place} on {path}")
                     server.unserve(path)
@@ -62,4 +64,4 @@ async def _trav(nurs: trio.Nursery, origin):
 
         print(fpath[len(srvDir) :])
         await server.serve(fpath, fpath[len(srvDir) :])
-    start_soon(nurs, trio.to_thread.run_sync, inotifyLoop, origin)
+    start_soon(nurs, runThread, inotifyLoop, origin)
@@ -0,0 +1,158 @@
+import atexit
+import contextlib
+import functools
+import os
+import threading
+import time
+
+# opt-in timing for the render pipeline: set MD2HTML_PROFILE=out.folded (or pass genall.py
+# --profile out.folded) and every phase (tokenize, buildTree, every rule, ...) gets timed. at exit
+# that gets written out as collapsed stacks (flamegraph.pl / speedscope / inferno read those) and
+# a summary table gets printed
+# NOTE: when this is off the only cost is a check for ``current is None`` per phase
+
+
+class Profiler:
+    def __init__(self):
+        self.local = threading.local()  # the stack of frames per thread
+        self.lock = threading.Lock()
+        self.stacks: dict[str, float] = {}  # "a;b;c" -> seconds spent in c itself
+        self.phases: dict[str, list] = {}  # name -> [calls, seconds], recursion counted once
+        self.counts: dict[str, int] = {}
+        # handler name -> [attempts, matches, seconds matching, seconds in the handler]
+        self.rules: dict[str, list] = {}
+
+    def _state(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+            self.local.mark = time.perf_counter()
+        return self.local
+
+    def _charge(self, st, now):
+        # the time since the last push/pop goes to whatever is on top of the stack
+        if st.stack:
+            key = ";".join(st.stack)
+            with self.lock:
+                self.stacks[key] = self.stacks.get(key, 0.0) + now - st.mark
+        st.mark = now
+
+    @contextlib.contextmanager
+    def frame(self, name):
+        st = self._state()
+        start = time.perf_counter()
+        self._charge(st, start)
+        outer = name not in st.stack
+        st.stack.append(name)
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self._charge(st, now)
+            st.stack.pop()
+            if outer:
+                with self.lock:
+                    stats = self.phases.setdefault(name, [0, 0.0])
+                    stats[0] += 1
+                    stats[1] += now - start
+
+    def count(self, name, n):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def _rule(self, fn):
+        # NOTE: only with self.lock held, renders run on more than one thread
+        return self.rules.setdefault(fn.__name__, [0, 0, 0.0, 0.0])
+
+    def attempt(self, rule, fn, buf):
+        start = time.perf_counter()
+        with self.frame("match:" + fn.__name__):
+            matches, datas = rule.check(buf)
+        took = time.perf_counter() - start
+        with self.lock:
+            stats = self._rule(fn)
+            stats[0] += 1
+            stats[1] += bool(matches)
+            stats[2] += took
+        return matches, datas
+
+    def handle(self, fn, page, datas):
+        start = time.perf_counter()
+        with self.frame("rule:" + fn.__name__):
+            out = fn(page, *datas)
+        took = time.perf_counter() - start
+        with self.lock:
+            self._rule(fn)[3] += took
+        return out
+
+    def collapsed(self):
+        # microseconds, flamegraph.pl wants whole numbers
+        return "".join(
+            f"{stack} {round(s * 1e6)}\n" for stack, s in sorted(self.stacks.items()) if s >= 5e-7
+        )
+
+    def summary(self):
+        # everything that was profiled, what the phases are a percentage of
+        total = sum(self.stacks.values()) or 1
+        out = [f"{'phase':<32} {'calls':>8} {'total ms':>10} {'%':>6}"]
+        for name, (calls, s) in sorted(self.phases.items(), key=lambda p: -p[1][1]):
+            if name.startswith(("match:", "rule:")):
+                continue
+            out.append(f"{name:<32} {calls:>8} {s * 1000:>10.2f} {s / total * 100:>5.1f}%")
+        out.append("")
+        out.append(
+            f"{'rule':<32} {'attempts':>8} {'matches':>8} {'match ms':>10} {'handler ms':>10}"
+        )
+        for name, (att, hit, m, h) in sorted(self.rules.items(), key=lambda r: -r[1][2] - r[1][3]):
+            out.append(f"{name:<32} {att:>8} {hit:>8} {m * 1000:>10.2f} {h * 1000:>10.2f}")
+        if self.counts:
+            out.append("")
+            out.append(", ".join(f"{name} {n}" for name, n in self.counts.items()))
+        return "\n".join(out)
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            f.write(self.collapsed())
+        print(self.summary())
+        print(f"collapsed stacks written to {path}")
+
+
+current: Profiler | None = None
+
+
+def enable(path):
+    # profile everything from here on, and write it all out to ``path`` at exit
+    global current
+    current = Profiler()
+    atexit.register(current.dump, path)
+    return current
+
+
+def phase(name):
+    return current.frame(name) if current is not None else contextlib.nullcontext()
+
+
+def timed(name):
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*a, **kw):
+            if current is None:
+                return fn(*a, **kw)
+            with current.frame(name):
+                return fn(*a, **kw)
+
+        return wrapper
+
+    return deco
+
+
+def nodes(root):
+    n, stack = 0, [root]
+    while stack:
+        node = stack.pop()
+        n += 1
+        stack.extend(getattr(node, "children", ()))
+    return n
+
+
+if os.environ.get("MD2HTML_PROFILE"):
+    enable(os.environ["MD2HTML_PROFILE"])
@@ -0,0 +1,73 @@
+split = lambda path: path.strip('/').split('/')
+
+
+class Router:
+    # exact paths (every static file) live in a flat dict, so looking them up is one hash no
+    # matter how many there are. only the routes with wildcards go into the trie:
+    # '%' matches a single part, '%%' matches everything that is left
+    def __init__(self):
+        self.exact = {}
+        self.tree = {}
+
+    def add(self, path, f):
+        parts = split(path)
+        if '%' not in parts and '%%' not in parts:
+            self.exact['/'.join(parts)] = f
+            return
+
+        cur = self.tree
+        for part in parts:
+            if part not in cur:
+                cur[part] = {}
+            cur = cur[part]
+
+        # NOTE: '' indicates that this is the handler (and the route it was registered on) if we
+        # end up here
+        cur[''] = (f, '/'.join(parts))
+
+    def remove(self, path):
+        parts = split(path)
+        key = '/'.join(parts)
+        if key in self.exact:
+            del self.exact[key]
+            return
+
+        # walk down, then prune the branches that end up empty on the way back
+        nodes = [self.tree]
+        for part in parts:
+            nodes.append(nodes[-1][part])
+        del nodes[-1]['']
+        for part, node in zip(reversed(parts), reversed(nodes[:-1])):
+            if node[part]:
+                break
+            del node[part]
+
+    def get(self, path: str):
+        # returns the handler, the parts the wildcards captured, and the route that matched
+        path = path.strip('/')
+        if (f := self.exact.get(path)) is not None:
+            return f, [], path
+        if not self.tree:
+            return None, [], None
+
+        cur = self.tree
+        params = []
+        parts = path.split('/')
+        for i, part in enumerate(parts):
+            # first we check if there is an exact match
+            # afterwards, we check for a '%' wildcard (single part is wildcard-ed)
+            # NOTE: an empty part would find the '' handler key instead of a child
+            if part and (new := cur.get(part)):
+                cur = new
+            elif new := cur.get('%'):
+                params.append(part)
+                cur = new
+            else:
+                # if that also fails, we check for a '%%', which captures everything
+                if not (cur := cur.get('%%')):
+                    return None, [], None  # give up if that also doesnt exist
+                params.append('/'.join(parts[i:]))
+                break
+        if (leaf := cur.get('')) is None:
+            return None, [], None
+        return leaf[0], params, leaf[1]
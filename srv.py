@@ -1,10 +1,109 @@
 import trio
 import os
+import errno
+import mmap
+import socket
+from collections import OrderedDict
 import mimetypes
 import urllib.parse
 import traceback
+import hashlib
+import email.utils
+import time
+import math
+import sys
+from http import HTTPStatus
+
+import compress
+from router import Router
+from metrics import Metrics, AccessLog
+
+class HeadError(Exception):
+    def __init__(self, status: int, msg: str):
+        super().__init__(msg)
+        self.status = status
+
+
+class Reader:
+    # buffered reader over a stream - reads in big chunks and keeps whatever is left over
+    # after the head (the body, or the next request) for the next read
+    def __init__(self, stream: trio.SocketStream, chunk=65536):
+        self.stream = stream
+        self.chunk = chunk
+        self.buf = bytearray()
+
+    async def fill(self):
+        data = await self.stream.receive_some(self.chunk)
+        self.buf += data
+        return len(data)
+
+    async def readHead(self, maxSize: int):
+        # returns the raw head (without the blank line), or None if the peer closed cleanly
+        start = 0
+        while True:
+            # NOTE: we accept bare '\n' line endings too, like the old byte-by-byte loop did
+            # start a little earlier so we catch a terminator split between two reads
+            crlf = self.buf.find(b'\r\n\r\n', max(0, start - 3))
+            lf = self.buf.find(b'\n\n', max(0, start - 1))
+            if crlf != -1 and (lf == -1 or crlf < lf):
+                end, skip = crlf, 4
+                break
+            if lf != -1:
+                end, skip = lf, 2
+                break
+
+            if len(self.buf) > maxSize:
+                raise HeadError(431, 'request head too large')
+
+            start = len(self.buf)
+            if not await self.fill():
+                if self.buf.strip():
+                    raise HeadError(400, 'connection closed mid-head')
+                return None
+
+        if end > maxSize:
+            raise HeadError(431, 'request head too large')
+
+        head = bytes(self.buf[:end])
+        del self.buf[: end + skip]
+        return head
+
+    async def receive(self, n: int):
+        if not self.buf:
+            return await self.stream.receive_some(min(n, self.chunk))
+        out = bytes(self.buf[:n])
+        del self.buf[:n]
+        return out
+
+
+def parseHead(head: bytes, maxHeaders: int):
+    lines = head.split(b'\n')
+    if len(lines) - 1 > maxHeaders:
+        raise HeadError(431, 'too many headers')
+
+    try:
+        lines = [l.rstrip(b'\r').decode() for l in lines]
+        method, path, ver = lines[0].split(' ')
+    except ValueError:
+        raise HeadError(400, 'malformed request line')
+
+    headers = {}
+    for l in lines[1:]:
+        header, sep, value = l.partition(':')
+        if not sep:
+            raise HeadError(400, 'malformed header')
+        headers[header.strip().lower()] = value.strip().lower()
 
-split = lambda path: path.strip('/').split('/')
+    # NOTE: int() would take '-5', '+5' or '1_0' too
+    length = headers.get('content-length', '0')
+    if not (length.isascii() and length.isdigit()):
+        raise HeadError(400, 'malformed content-length')
+    # NOTE: chunked bodies arent supported, and on a kept-alive connection the chunks would get
+    # read as the next request - so these get an error and the connection gets closed
+    if 'transfer-encoding' in headers:
+        raise HeadError(501, 'transfer-encoding not supported')
+
+    return method, path, ver, headers
 
 
 class Request:
@@ -12,74 +111,322 @@ class Request:
         self.method: str
         self.path: str
         self.stream: trio.SocketStream
+        self.reader: Reader
         self.headers: dict[str, str]
         self.args: dict[str, list[str]]
+        self.params: list[str]  # whatever the '%'/'%%' wildcards in the route matched
         self.server: Server
         self.contentLength: int
+        self.remaining: int
+        # set when the response needs a Connection header (closing, or keep-alive on http/1.0)
+        self.connection: str | None = None
+        self.sent = False
+        self.bodyDeadline = math.inf
+        # for the access log and the metrics
+        self.ver = ''
+        self.status = 0
+        self.bytesSent = 0
 
     async def readBody(self, n=None):
-        return self.stream.receive_some(n)
+        # NOTE: part of the body might already be sitting in the reader's buffer
+        if self.remaining <= 0:
+            return b''
+        with trio.fail_at(self.bodyDeadline):
+            data = await self.reader.receive(min(n or self.remaining, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+    async def write(self, cont):
+        # the write deadline is about progress - every chunk gets writeTimeout to go out, so slow
+        # but steady clients can still download big files
+        view = memoryview(cont)
+        for o in range(0, len(view), self.server.chunk):
+            with trio.fail_after(self.server.writeTimeout):
+                await self.stream.send_all(view[o : o + self.server.chunk])
+        self.bytesSent += len(view)
 
     async def sendRaw(self, cont: bytes):
-        await self.stream.send_all(cont)
+        if not self.sent:
+            self.status = int(bytes(cont[9:12]))  # 'HTTP/1.1 200 OK'
+        if self.connection and not self.sent:
+            # prebuilt responses dont know what happens to the connection, so we splice the
+            # header in after the status line (without copying the body)
+            i = cont.index(b'\n')
+            await self.write(cont[:i] + f'\nConnection: {self.connection}'.encode())
+            cont = memoryview(cont)[i:]
+        self.sent = True
+        await self.write(cont)
+
+    async def sendFile(self, f, offset: int, count: int):
+        # send ``count`` bytes of ``f`` starting at ``offset`` without copying them through python
+        self.sent = True
+        end = offset + count
+
+        if self.server.sendfile and isinstance(self.stream, trio.SocketStream):
+            # straight from the page cache to the socket
+            sock = self.stream.socket
+            while offset < end:
+                try:
+                    n = os.sendfile(sock.fileno(), f.fileno(), offset, end - offset)
+                except BlockingIOError:
+                    # NOTE: this is where we let the other tasks run while the client catches up
+                    with trio.fail_after(self.server.writeTimeout):
+                        await trio.lowlevel.wait_writable(sock)
+                    continue
+                except OSError as e:
+                    # NOTE: some filesystems cant do sendfile, mmap still works there
+                    if e.errno not in {errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP}:
+                        raise
+                    break
+                if not n:
+                    raise EOFError(f'{f.name} shrank while sending it')
+                offset += n
+                self.bytesSent += n
+
+        if offset >= end:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if len(mm) < end:
+                raise EOFError(f'{f.name} shrank while sending it')
+            view = memoryview(mm)
+            try:
+                await self.write(view[offset:end])
+            finally:
+                view.release()
 
     async def send(self, status: int, headers: dict[str, str], cont: bytes):
         await self.sendRaw(self.server.buildReq(status, headers, cont))
 
 
+class Asset:
+    # everything we need to answer a request for a file - the body (or where to find it on disk)
+    # and the validators for conditional/range requests
+    def __init__(
+        self,
+        headers: dict[str, str],
+        size: int,
+        etag: str,
+        mtime: float | None = None,
+        path: str | None = None,
+        vary=False,
+        cacheable=False,
+    ):
+        self.size = size
+        self.etag = etag
+        self.mtime = int(mtime if mtime is not None else time.time())
+        self.path = path
+        # whether the body can be dropped from memory and read back from ``path`` later
+        self.cacheable = cacheable
+        self.validators = {
+            'ETag': etag,
+            'Last-Modified': email.utils.formatdate(self.mtime, usegmt=True),
+        }
+        if vary:
+            self.validators['Vary'] = 'Accept-Encoding'
+        self.headers = {**headers, **self.validators, 'Accept-Ranges': 'bytes'}
+        # head of the 200 response, for when the body comes from disk
+        self.head: bytes
+
+        # NOTE: everything below is only set while the asset is in memory
+        self.cont: memoryview | None = None
+        # the prebuilt 200 response
+        self.response: bytes | None = None
+        # content-encoding -> (etag, prebuilt 200 response)
+        self.encoded: dict[str, tuple[str, bytes]] = {}
+        self.memory = 0
+        # set while it is being read back into memory, see Server.admit
+        self.admitting = False
+
+    def unload(self):
+        self.cont = None
+        self.response = None
+        self.encoded = {}
+        self.memory = 0
+
+
+class AssetCache:
+    # keeps the prebuilt responses of the most recently used files in memory, up to ``budget``
+    # bytes. everything else is served from disk
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.used = 0
+        self.lru: OrderedDict[Asset, None] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def touch(self, a: Asset):
+        if a in self.lru:
+            self.lru.move_to_end(a)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, a: Asset):
+        if a.memory > self.budget:
+            # it would never fit, so dont bother reading it back in on every miss either
+            a.unload()
+            a.cacheable = False
+            return
+        while self.used + a.memory > self.budget:
+            old, _ = self.lru.popitem(last=False)
+            self.used -= old.memory
+            old.unload()
+            self.evictions += 1
+        self.lru[a] = None
+        self.used += a.memory
+
+    def discard(self, a: Asset):
+        if a in self.lru:
+            del self.lru[a]
+            self.used -= a.memory
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'resident': len(self.lru),
+            'used': self.used,
+            'budget': self.budget,
+        }
+
+
 class Server:
-    def __init__(self, host='0.0.0.0', port=8080, headers: None | dict = None):
-        self.tree = {}
+    def __init__(
+        self,
+        host='0.0.0.0',
+        port=8080,
+        headers: None | dict = None,
+        maxHeadSize=65536,
+        maxHeaders=100,
+        keepAliveTimeout=5,
+        maxRequests=100,
+        maxDrain=65536,
+        chunk=4194304,
+        cacheBudget=64 * 1024 * 1024,
+        maxConnections=1000,
+        backlog=None,
+        headerTimeout=10,
+        bodyTimeout=30,
+        writeTimeout=30,
+        queueTimeout=5,
+        accessLog=True,
+    ):
+        self.router = Router()
         self.host = host
         self.port = port
         self.headers = headers or {}
+        self.maxHeadSize = maxHeadSize
+        self.maxHeaders = maxHeaders
+        self.keepAliveTimeout = keepAliveTimeout
+        self.maxRequests = maxRequests
+        # unread request bodies up to this size get skipped so the connection can be reused
+        self.maxDrain = maxDrain
+        # how much of a mmap-ed file we hand to send_all at once
+        self.chunk = chunk
+        self.sendfile = hasattr(os, 'sendfile')
+        # requests with more ranges than this just get the whole file
+        self.maxRanges = 16
+        # files bigger than this are always streamed from disk
+        self.maxInMemory = 16000000  # 16mb
+        self.cache = AssetCache(cacheBudget)
+        # urls whose response was handed to us in memory (see publish), not read from a file
+        self.published: set[str] = set()
+
+        self.limiter = trio.CapacityLimiter(maxConnections)
+        self.backlog = backlog  # None lets trio pick (the system maximum)
+        # a client gets keepAliveTimeout to start a request, then headerTimeout to finish the
+        # head, bodyTimeout for the whole body, and writeTimeout for every chunk of the response
+        self.headerTimeout = headerTimeout
+        self.bodyTimeout = bodyTimeout
+        self.writeTimeout = writeTimeout
+        # how long a new connection waits for a free slot before getting a 503
+        self.queueTimeout = queueTimeout
+        # cancel scopes of the connections that are waiting for a request head, oldest first
+        self.waiting: OrderedDict[trio.CancelScope, None] = OrderedDict()
+
+        # see shutdown
+        self.draining = False
+        self.accepting = trio.CancelScope()
+        self.connections: trio.Nursery | None = None
+        # for the work that shouldnt hold up a response, like reading evicted files back in
+        self.background: trio.Nursery | None = None
+
+        self.metrics = Metrics()
+        self.accessLog = AccessLog(sys.stdout) if accessLog else None
 
     async def fail(self, r: Request):
-        await r.sendRaw('HTTP/1.1 404 Not Found'.encode())
+        await r.send(404, {}, b'')
 
     async def serverError(self, r: Request):
-        await r.sendRaw('HTTP/1.1 505 Internal Server Error'.encode())
+        await r.send(500, {}, b'')
 
-    async def start(self):
-        await trio.serve_tcp(self.handle, port=self.port, host=self.host)
+    def listenSocket(self, reusePort=False):
+        # a listening socket, to hand to forked workers (or for every worker to open its own
+        # with SO_REUSEPORT)
+        return socket.create_server(
+            (self.host, self.port), backlog=self.backlog, reuse_port=reusePort
+        )
+
+    async def start(self, sock: socket.socket | None = None):
+        if sock is None:
+            listeners = await trio.open_tcp_listeners(
+                self.port, host=self.host, backlog=self.backlog
+            )
+        else:
+            listeners = [trio.SocketListener(trio.socket.from_stdlib_socket(sock))]
+
+        async with trio.open_nursery() as self.background:
+            if self.accessLog:
+                self.background.start_soon(self.accessLog.run)
+
+            async with trio.open_nursery() as self.connections:
+                with self.accepting:
+                    await trio.serve_listeners(
+                        self.handle, listeners, handler_nursery=self.connections
+                    )
+                # we only get here after shutdown, the nursery waits for the open connections
+                for l in listeners:
+                    await l.aclose()
+
+            if self.accessLog:
+                await self.accessLog.aclose()  # lets it write out what is left and return
+
+    def shutdown(self, timeout=30):
+        # stop accepting, finish the requests that are in flight, and give up on them after
+        # ``timeout`` seconds
+        self.draining = True
+        self.accepting.cancel()
+        for scope in [*self.waiting]:
+            scope.cancel()
+        if self.connections:
+            self.connections.cancel_scope.deadline = trio.current_time() + timeout
 
     def handler(self, path):
         def fn(f):
-            parts = split(path)
-            cur = self.tree
-
-            for part in parts:
-                if part not in cur:
-                    cur[part] = {}
-                cur = cur[part]
-
-            # NOTE: '' indicates that this is the handler if we end up here
-            cur[''] = f
+            self.router.add(path, f)
+            return f
 
         return fn
 
     def unserve(self, path):
-        parts = split(path)
-        cur = self.tree
+        self.dropAsset(path)
+        self.router.remove(path)
+        self.published.discard(path)
 
-        for part in parts:
-            cur = cur[part]
+    def dropAsset(self, path):
+        # forget the cached response of whatever file is served on ``path``
+        if (a := getattr(self.getHandler(path), 'asset', None)) is not None:
+            self.cache.discard(a)
 
-        del cur['']
+    def route(self, path: str):
+        return self.router.get(path)
 
     def getHandler(self, path: str):
-        cur = self.tree
-        for part in path.split('/'):
-            # first we check if there is an exact match
-            # afterwards, we check for a '%' wildcard (single part is wildcard-ed)
-            if not (new := cur.get(part)) and not (new := cur.get('%')):
-                # if that also fails, we check for a '%%', which captures everything
-                # NOTE: we set cur here, because we break, and so we will not reach ``cur = new``
-                if not (cur := cur.get('%%')):
-                    return None  # give up if that also doesnt exist
-                break
-            cur = new
-        return cur.get('')
+        return self.router.get(path)[0]
 
     def serving(self, path):
         return self.getHandler(path) is not None
@@ -88,9 +435,11 @@ class Server:
         self, status: int, headers: dict[str, str], cont: bytes, l: int | None = None
     ):
         headers = {**self.headers, **headers}
+        # NOTE: a 304 has no body, and its Content-Length would have to be the one of the 200
+        length = f'Content-Length: {len(cont) if l is None else l}\n' if status != 304 else ''
         # TODO: support up to http v3
         return (
-            f'HTTP/1.1 {status} OK\nContent-Length: {l or len(cont)}\n'
+            f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\n{length}'
             + (
                 '\n'.join([name + ': ' + val for name, val in headers.items()]) + '\n'
                 if headers
@@ -99,102 +448,432 @@ class Server:
             + '\n'
         ).encode() + cont
 
+    def keepAlive(self, ver: str, headers: dict[str, str]):
+        conn = {t.strip() for t in headers.get('connection', '').split(',')}
+        if ver == 'HTTP/1.0':
+            return 'keep-alive' in conn
+        return 'close' not in conn
+
+    async def drain(self, r: Request):
+        # skip whatever the handler didnt read from the body, so the next request starts
+        # at the right place
+        if r.remaining > self.maxDrain:
+            return False
+        while r.remaining > 0:
+            if not await r.readBody():
+                return False
+        return True
+
     async def handle(self, stream: trio.SocketStream):
-        buf = b''
-        lines = []
-        headers = {}
+        if not self.limiter.available_tokens and self.waiting:
+            # we are full - make room by dropping whoever has been sitting on a connection without
+            # sending a request the longest (idle keep-alives and slow-loris clients)
+            scope, _ = self.waiting.popitem(last=False)
+            scope.cancel()
+
+        acquired = False
+        with trio.move_on_after(self.queueTimeout):
+            await self.limiter.acquire_on_behalf_of(stream)
+            acquired = True
+        if not acquired:
+            try:
+                await stream.send_all(self.buildReq(503, {'Connection': 'close'}, b''))
+            except trio.BrokenResourceError:
+                pass
+            await stream.aclose()
+            return
 
         try:
-            while c := await stream.receive_some(1):
-                if c == b'\n':
-                    if buf[-1] == ord('\r'):
-                        buf = buf[:-1]
+            await self.serveConnection(stream)
+        finally:
+            self.limiter.release_on_behalf_of(stream)
+
+    async def readRequest(self, reader: Reader):
+        # returns the parsed head, or None if the connection should be closed
+        # the deadline starts as the idle timeout, and turns into the header timeout as soon as
+        # the first bytes of the request show up
+        with trio.CancelScope(
+            deadline=trio.current_time() + self.keepAliveTimeout
+        ) as scope:
+            self.waiting[scope] = None
+            try:
+                if not reader.buf and not await reader.fill():
+                    return None
+                scope.deadline = trio.current_time() + self.headerTimeout
+                head = await reader.readHead(self.maxHeadSize)
+                if head is None:
+                    return None
+                return parseHead(head, self.maxHeaders)
+            finally:
+                self.waiting.pop(scope, None)
+
+        if reader.buf:
+            # timed out in the middle of the head
+            with trio.move_on_after(1):
+                await reader.stream.send_all(self.buildReq(408, {'Connection': 'close'}, b''))
+        return None
+
+    def observe(self, r: Request, route: str | None, seconds: float):
+        # NOTE: metrics are per route and not per path, so scanners cant blow up the label count
+        self.metrics.record(
+            '(none)' if route is None else '/' + route, r.status, r.bytesSent, seconds
+        )
+        if self.accessLog:
+            self.accessLog.log(
+                f'{r.method} {r.path} {r.ver} {r.status} {r.bytesSent} {seconds * 1000:.2f}ms'
+            )
+
+    async def serveConnection(self, stream: trio.SocketStream):
+        reader = Reader(stream)
 
-                    if not buf:
+        try:
+            # NOTE: pipelined requests just sit in the reader's buffer, so handling them one after
+            # the other keeps the responses in order
+            for n in range(self.maxRequests):
+                if self.draining:
+                    break
+                try:
+                    if (req := await self.readRequest(reader)) is None:
+                        break
+                    method, path, ver, headers = req
+                except HeadError as e:
+                    with trio.move_on_after(self.writeTimeout):
+                        await stream.send_all(
+                            self.buildReq(e.status, {'Connection': 'close'}, b'')
+                        )
+                    break
+
+                parsed = urllib.parse.urlparse(path)
+                path = urllib.parse.unquote_plus(parsed.path).strip('/')
+
+                r = Request()
+                r.method = method
+                r.ver = ver
+                r.path = parsed.path
+                r.stream = stream
+                r.reader = reader
+                r.headers = headers
+                r.args = urllib.parse.parse_qs(parsed.query)
+                r.contentLength = int(headers.get('content-length', '0'))
+                r.remaining = r.contentLength
+                r.bodyDeadline = trio.current_time() + self.bodyTimeout
+                r.server = self
+
+                keep = (
+                    self.keepAlive(ver, headers)
+                    and n + 1 < self.maxRequests
+                    and not self.draining
+                )
+                if not keep:
+                    r.connection = 'close'
+                elif ver == 'HTTP/1.0':
+                    r.connection = 'keep-alive'
+
+                fn, r.params, route = self.route(path)
+                started = time.perf_counter()
+                try:
+                    await (fn or self.fail)(r)
+                except BaseException as e:
+                    # this is a different try just because we might get an error in the handler
+                    # if the response was already started, there is nothing sane to send anymore
+                    if not r.sent:
+                        r.connection = 'close'
+                        if isinstance(e, trio.TooSlowError):
+                            await r.send(408, {}, b'')  # the body took too long
+                        else:
+                            await self.serverError(r)
+                    # traceback.print_exception(e)
+                    break
+                finally:
+                    self.observe(r, route, time.perf_counter() - started)
+
+                try:
+                    if not keep or not await self.drain(r):
                         break
+                except trio.TooSlowError:
+                    break
 
-                    lines.append(buf)
-                    buf = b''
-                    continue
+            with trio.move_on_after(1):
+                await stream.send_eof()
 
-                buf += c
-
-            # parse headers
-            for l in lines[1:]:
-                parts = l.decode().split(':')
-                header = parts[0].strip().lower()
-                value = ':'.join(parts[1:]).strip().lower()
-                headers[header] = value
-
-            method, path, ver = lines[0].decode().split(' ')
-            parsed = urllib.parse.urlparse(path)
-            path = urllib.parse.unquote_plus(parsed.path).strip('/')
-            print(f'{method} {"/" + path} {ver}')
-
-            r = Request()
-            r.method = method
-            r.path = parsed.path
-            r.stream = stream
-            r.headers = headers
-            r.args = urllib.parse.parse_qs(parsed.query)
-            r.contentLength = int(headers.get('content-length', '0'))
-            r.server = self
+        except (trio.BrokenResourceError, trio.TooSlowError):
+            pass  # the client went away (or stopped reading), nothing to do about it
+        except Exception:
+            traceback.print_exc()
+            print('connection closed')
+        finally:
+            await stream.aclose()
 
-            try:
-                await (self.getHandler(path) or self.fail)(r)
-            except BaseException as e:
-                # this is a different try just because we might get an error in the handler
-                await self.serverError(r)
-                # traceback.print_exception(e)
+    def load(self, a: Asset, cont: bytes, variants: dict[str, bytes]):
+        a.response = self.buildReq(200, a.headers, cont)
+        # NOTE: the body is a view into the response, so we dont keep it in memory twice
+        a.cont = memoryview(a.response)[len(a.response) - a.size :]
+        a.encoded = {}
+        for enc, body in variants.items():
+            # every representation needs its own etag
+            etag = a.etag[:-1] + f'-{enc}"'
+            headers = {**a.headers, 'ETag': etag, 'Content-Encoding': enc}
+            a.encoded[enc] = (etag, self.buildReq(200, headers, body))
+        a.memory = len(a.response) + sum(len(r) for _, r in a.encoded.values())
+
+    async def admit(self, a: Asset):
+        # read an evicted file back into memory
+        try:
+            cont, variants = await trio.to_thread.run_sync(
+                readAsset, a.path, a.headers['Content-Type'], 'Vary' in a.validators
+            )
+        except OSError:
+            return  # gone already, the static watcher will unserve it
+        finally:
+            a.admitting = False
+        # somebody else might have loaded it while we were reading, or the file changed under us
+        # (in which case it will get re-served anyway)
+        if a.response is not None or etagOf(cont) != a.etag:
+            return
+        self.load(a, cont, variants)
+        self.cache.add(a)
 
-            await stream.send_eof()
-            await stream.aclose()
+    def serveAsset(self, a: Asset, url):
+        a.head = self.buildReq(200, a.headers, b'', a.size)
+        self.dropAsset(url)
+        if a.cacheable and a.response is not None:
+            self.cache.add(a)
+
+        @self.handler(url)
+        async def fn(r: Request):
+            if not a.cacheable:
+                await self.sendAsset(r, a)
+                return
+
+            hit = self.cache.touch(a)
+            await self.sendAsset(r, a)
+            # NOTE: reading (and compressing) it again can take a while, the next request on this
+            # connection shouldnt have to wait for it. and one read per file is enough
+            if not hit and not a.admitting and a.cacheable:
+                a.admitting = True
+                if self.background is not None:
+                    self.background.start_soon(self.admit, a)
+                else:
+                    await self.admit(a)
+
+        fn.asset = a
+
+    async def sendBody(self, r: Request, a: Asset, offset: int, count: int):
+        if not count:
+            return
+        if (cont := a.cont) is not None:
+            await r.sendRaw(cont[offset : offset + count])
+            return
+        with open(a.path, 'rb') as f:
+            await r.sendFile(f, offset, count)
+
+    async def sendAsset(self, r: Request, a: Asset):
+        enc = None
+        if a.encoded and 'range' not in r.headers:
+            # NOTE: ranges always come from the identity body
+            enc = compress.negotiate(r.headers.get('accept-encoding', ''), a.encoded)
+        etag, response = a.encoded[enc] if enc else (a.etag, a.response)
+
+        # NOTE: only GET and HEAD get a 304, anything else with a matching If-None-Match gets a 412
+        # (and If-Modified-Since doesnt mean anything for them)
+        if r.method in ('GET', 'HEAD'):
+            if notModified(r.headers, a, etag):
+                await r.send(304, {**a.validators, 'ETag': etag}, b'')
+                return
+        elif noneMatch(r.headers, etag):
+            await r.send(412, {}, b'')
             return
 
-        except:
-            traceback.print_exc()
-            print('connection closed')
+        ranges = None
+        if r.method == 'GET' and 'range' in r.headers and ifRange(r.headers, a):
+            ranges = parseRange(r.headers['range'], a.size)
 
-    def genericServe(self, cont, path, fpath='', headers={}):
-        send = self.buildReq(
-            200, {**mtype(fpath or path, getEncoding(cont)), **headers}, cont
-        )
+        if ranges == []:
+            await r.send(416, {'Content-Range': f'bytes */{a.size}'}, b'')
+            return
 
-        @self.handler(path)
-        async def fn(r: Request):
-            await r.sendRaw(send)
+        if ranges is None or len(ranges) > self.maxRanges:
+            if response is not None:
+                await r.sendRaw(response)
+            else:
+                await r.sendRaw(a.head)
+                await self.sendBody(r, a, 0, a.size)
+            return
 
-    def streamServe(self, path, url, fpath='', headers={}):
-        s = os.path.getsize(path)
-        send = self.buildReq(200, {**mtype(fpath or path, None), **headers}, b'', s)
-        chunks = 4000000
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            headers = {**a.headers, 'Content-Range': f'bytes {start}-{end - 1}/{a.size}'}
+            await r.sendRaw(self.buildReq(206, headers, b'', end - start))
+            await self.sendBody(r, a, start, end - start)
+            return
 
-        async def read(send, f, s):
-            b = await f.read(s)
-            await send.send(b)
+        # multipart/byteranges - bytes are sent as is, (offset, count) pairs come from the body
+        boundary = a.etag.strip('"')
+        parts = []
+        for start, end in ranges:
+            parts += [
+                (
+                    f'--{boundary}\r\nContent-Type: {a.headers["Content-Type"]}\r\n'
+                    f'Content-Range: bytes {start}-{end - 1}/{a.size}\r\n\r\n'
+                ).encode(),
+                (start, end - start),
+                b'\r\n',
+            ]
+        parts.append(f'--{boundary}--\r\n'.encode())
+
+        l = sum(len(p) if isinstance(p, bytes) else p[1] for p in parts)
+        headers = {
+            **a.headers,
+            'Content-Type': f'multipart/byteranges; boundary={boundary}',
+        }
+        await r.sendRaw(self.buildReq(206, headers, b'', l))
+        for p in parts:
+            if isinstance(p, bytes):
+                await r.sendRaw(p)
+            else:
+                await self.sendBody(r, a, *p)
+
+    def genericServe(
+        self, cont, path, fpath='', headers={}, mtime=None, variants=None, source=None
+    ):
+        # ``source`` is the file ``cont`` came from - if given, the cache can drop ``cont`` and
+        # read it back later
+        headers = {**mtype(fpath or path, getEncoding(cont)), **headers}
+        if variants is None and 'Content-Encoding' not in headers:
+            variants = compress.variants(cont, headers['Content-Type'])
+        a = Asset(
+            headers,
+            len(cont),
+            etagOf(cont),
+            mtime,
+            path=source,
+            vary=bool(variants),
+            cacheable=source is not None,
+        )
+        self.load(a, cont, variants or {})
+        self.serveAsset(a, path)
 
-        @self.handler(url)
-        async def fn(r: Request):
-            si = s
-            await r.sendRaw(send)
-            async with await trio.open_file(path, 'rb') as f:
-                async with trio.open_nursery() as nurs:
-                    dat = await f.read(chunks)
-                    _send, recv = trio.open_memory_channel(chunks)
-                    while si > 0:
-                        nurs.start_soon(read, _send, f, min(si, chunks))
-                        si -= chunks
-                        await r.sendRaw(dat)
-                        dat = await recv.receive()
-                    await _send.aclose()
+    def streamServe(self, path, url, fpath='', headers={}):
+        st = os.stat(path)
+        headers = {**mtype(fpath or path, None), **headers}
+        # NOTE: hashing a huge file on every change is too slow, size + mtime + inode is what
+        # most servers use for these
+        etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}-{st.st_ino:x}"'
+        a = Asset(headers, st.st_size, etag, st.st_mtime, path=path)
+        self.serveAsset(a, url)
+
+    async def publish(self, cont: bytes, url, headers={}, compressed=True):
+        # serve ``cont`` on ``url`` from memory, without a file behind it. the new response is
+        # built completely before the route switches over to it, requests that already started
+        # keep sending the old one
+        variants = {}
+        if compressed and 'Content-Encoding' not in headers:
+            ctype = {**mtype(url, getEncoding(cont)), **headers}['Content-Type']
+            variants = await trio.to_thread.run_sync(compress.variants, cont, ctype)
+        self.genericServe(cont, url, headers=headers, variants=variants)
+        self.published.add(url)
 
     async def serve(self, fpath, url=None, headers={}):
         url = url or fpath
-        if os.path.getsize(fpath) > 16000000:  # 16mb
+        # NOTE: a file showing up for a published url (someone writing the same page to disk) is
+        # just a copy of what we already have
+        if url in self.published:
+            return
+        if os.path.getsize(fpath) > self.maxInMemory:
             self.streamServe(fpath, url, headers=headers)
         else:
-            file = await trio.open_file(fpath, 'rb')
-            self.genericServe(await file.read(), url, headers=headers)
+            async with await trio.open_file(fpath, 'rb') as file:
+                cont = await file.read()
+            # compressing (brotli especially) is slow, so dont do it on the event loop
+            variants = {}
+            if 'Content-Encoding' not in headers:
+                ctype = {**mtype(url), **headers}['Content-Type']
+                variants = await trio.to_thread.run_sync(compress.variants, cont, ctype)
+            if url in self.published:  # it might have been published while we were reading
+                return
+            self.genericServe(
+                cont,
+                url,
+                headers=headers,
+                mtime=os.path.getmtime(fpath),
+                variants=variants,
+                source=fpath,
+            )
+
+
+def etagOf(cont: bytes):
+    return '"' + hashlib.blake2b(cont, digest_size=16).hexdigest() + '"'
+
+
+def readAsset(path, ctype, compressed):
+    # runs in a worker thread
+    with open(path, 'rb') as f:
+        cont = f.read()
+    return cont, compress.variants(cont, ctype) if compressed else {}
+
+
+def noneMatch(headers: dict[str, str], etag: str):
+    # whether If-None-Match matches ``etag`` (so its condition fails)
+    if (inm := headers.get('if-none-match')) is None:
+        return False
+    tags = {t.strip().removeprefix('w/') for t in inm.split(',')}
+    return '*' in tags or etag in tags
+
+
+def notModified(headers: dict[str, str], a: Asset, etag: str):
+    # If-None-Match wins over If-Modified-Since when both are there
+    if 'if-none-match' in headers:
+        return noneMatch(headers, etag)
+
+    if (ims := headers.get('if-modified-since')) is not None:
+        try:
+            return a.mtime <= email.utils.parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
+
+def ifRange(headers: dict[str, str], a: Asset):
+    # only honor Range if the client still has the version we are serving
+    if (cond := headers.get('if-range')) is None:
+        return True
+    if cond.startswith('"'):
+        return cond == a.etag
+    try:
+        return a.mtime == email.utils.parsedate_to_datetime(cond).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+def parseRange(value: str, size: int):
+    # returns a list of [start, end) pairs, [] if nothing is satisfiable, or None if the header
+    # should be ignored
+    unit, _, spec = value.partition('=')
+    if unit.strip() != 'bytes':
+        return None
+
+    out = []
+    for part in spec.split(','):
+        first, sep, last = part.strip().partition('-')
+        # NOTE: this also rejects negative numbers and a lone '-'
+        if not sep or not (first + last).isdigit():
+            return None
+
+        if not first:  # suffix range, the last n bytes
+            start, end = max(0, size - int(last)), size
+            if not int(last):
+                continue
+        else:
+            start = int(first)
+            end = min(size, int(last) + 1) if last else size
+            if last and int(last) < start:
+                return None
+
+        if start < end:
+            out.append((start, end))
+
+    return out
 
 
 def mtype(path, enc=None):
@@ -1,10 +1,20 @@
+import argparse
 import importlib
 import os
-from conf import server, root, initers, start_soon
+import signal
+import socket
+import time
+import traceback
+
 import trio
 
+from conf import server, root, initers, singleIniters, start_soon
+
+# how long a worker gets to finish its requests after SIGTERM
+drainTimeout = 30
+
 
-async def main():
+def load():
     print(os.listdir(os.path.join(root, "paths")))
     for file in os.listdir(os.path.join(root, "paths")):
         print(file)
@@ -17,10 +27,97 @@ async def main():
 
     print("loaded everything!")
 
+
+async def stopOnSignal():
+    with trio.open_signal_receiver(signal.SIGTERM) as signals:
+        async for _ in signals:
+            print(f"[{os.getpid()}] draining")
+            server.shutdown(drainTimeout)
+            return
+
+
+async def main(primary=True, sock=None):
+    load()
+
     async with trio.open_nursery() as nurs:
-        for initer in initers:
+        for initer in initers + (singleIniters if primary else []):
             print(initer)
             start_soon(nurs, initer)
-        await server.start()
+        nurs.start_soon(stopOnSignal)
+        await server.start(sock)
+        # the server only returns after draining, take the watchers down with it
+        nurs.cancel_scope.cancel()
+
+
+def worker(i, sock):
+    # NOTE: only worker 0 regenerates the html, so the workers dont race on writing static/
+    code = 0
+    try:
+        trio.run(main, i == 0, sock or server.listenSocket(reusePort=True))
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    os._exit(code)
+
+
+def supervise(n, reusePort):
+    # forks ``n`` workers, restarts the ones that die, and passes SIGTERM on to them
+    # NOTE: this has to happen before anything starts a trio loop, forking one is a bad idea
+    sock = None if reusePort else server.listenSocket()
+    children = {}  # pid -> worker index
+    stopping = False
+
+    def spawn(i):
+        if (pid := os.fork()) == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            # NOTE: ctrl-c goes to the whole process group. the workers leave it to the supervisor,
+            # which turns it into a SIGTERM for them, so they still get to drain
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            worker(i, sock)
+        children[pid] = i
+
+    def stop(sig, _):
+        nonlocal stopping
+        stopping = True
+        for pid in [*children]:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for i in range(n):
+        spawn(i)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        i = children.pop(pid)
+        if not stopping:
+            print(f"worker {i} ({pid}) died with status {status}, restarting it")
+            time.sleep(1)  # dont spin if it dies right away every time
+            # a SIGTERM during the sleep already went out to the others, this one would miss it
+            if not stopping:
+                spawn(i)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="fork this many worker processes (0 runs everything in this process)",
+    )
+    parser.add_argument(
+        "--no-reuseport",
+        action="store_true",
+        help="share one listening socket instead of SO_REUSEPORT",
+    )
+    args = parser.parse_args()
 
-trio.run(main)
\ No newline at end of file
+    if args.workers:
+        supervise(args.workers, hasattr(socket, "SO_REUSEPORT") and not args.no_reuseport)
+    else:
+        trio.run(main)